@@ -0,0 +1,304 @@
+"""Headless JSON prediction API (asyncio, stdlib only).
+
+Same feature assembly, CI and EVT rule as the Streamlit app, for EHR
+integration behind a gateway:
+
+    python api_server.py --port 8502
+
+    GET  /health
+    GET  /stats
+    GET  /metrics         Prometheus text format (see metrics.py)
+    POST /predict         {"age": 72, "sex_numeric": "Male", ..., "vessel_numeric": "A1", ...}
+    POST /predict/batch   {"patients": [{...}, {...}]}
+
+Either body may name an inference profile ("profile": "fast"); the default
+is the deployment's MDVO_PROFILE (see inference_profiles.py).
+
+Every row is checked against patient_schema (ranges, codes, NaN) first;
+a request with a bad cell gets 400 with a per-feature report under
+"invalid". Blocking model calls and store reads run off the event loop:
+single rows go through the shared InferenceBatcher, batches through a
+bounded thread pool. When more than --max-pending requests are queued, or
+the profile's batcher queue is full, the server answers 429.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+
+from fit_cache import load_warm_model
+from inference_profiles import DEFAULT_PROFILE, ProfiledModel, get_profile
+from metrics import METRICS
+from patient_schema import report_fields, validate
+from prediction_cache import PredictionCache
+from prediction_store import PredictionStore
+from predictor import (MODEL_PATH, FEATURES, model_identity, encode_value,
+                       create_input_data, to_prediction)
+
+logger = logging.getLogger('mdvo.api')
+
+MAX_BODY = 10 * 1024 * 1024
+MAX_BATCH_ROWS = 10000
+
+
+class RequestError(Exception):
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details or {}    # extra keys of the error body
+
+    def payload(self):
+        return {'error': str(self), **self.details}
+
+
+def patient_to_input(patient):
+    if not isinstance(patient, dict):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "each patient must be a JSON object")
+    missing = [f for f in FEATURES if f not in patient]
+    if missing:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"missing features: {', '.join(missing)}")
+    try:
+        return create_input_data(*(encode_value(f, patient[f]) for f in FEATURES))
+    except (TypeError, ValueError) as e:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"invalid feature value: {e}")
+
+
+def check_inputs(X):
+    # Out-of-range values, unknown codes and NaN are refused, never scored
+    report = validate(X)
+    if not report.ok:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "feature values outside the allowed ranges or codes",
+                           {'invalid': report_fields(report)})
+    return X
+
+
+class PredictionService:
+    def __init__(self, model_path=MODEL_PATH, workers=2, max_concurrency=4, max_pending=64,
+                 clf=None, store=True):
+        # clf may be passed in already loaded (e.g. inherited from a pre-fork parent)
+        self.clf = clf if clf is not None else load_warm_model(model_path)
+        self.profiles = {}          # profile name -> ProfiledModel, built on first request
+        self.cache = PredictionCache(maxsize=4096, model_id=model_identity(model_path))
+        # Opened per process (also in pre-forked workers), so restarted workers serve warm
+        self.store = PredictionStore.for_model(model_path, profile=DEFAULT_PROFILE) if store else None
+        if self.store is not None:
+            self.store.purge_stale()
+        self.batcher = self.profiled(DEFAULT_PROFILE).batcher
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-batch')
+        self.model_slots = asyncio.Semaphore(max_concurrency)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        METRICS.register_collector(self.gauges)
+
+    def gauges(self):
+        cache = self.cache.stats()
+        return {'api_pending': self.pending, 'api_rejected': self.rejected,
+                'prediction_cache_size': cache['size'], 'prediction_cache_hits': cache['hits'],
+                'prediction_cache_misses': cache['misses'], 'prediction_cache_hit_rate': cache['hit_rate']}
+
+    def admit(self):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise RequestError(HTTPStatus.TOO_MANY_REQUESTS, "prediction queue is full, retry later")
+        self.pending += 1
+
+    def queue_full(self):
+        # The profile's batcher queue is bounded too (MDVO_MAX_PENDING)
+        self.rejected += 1
+        return RequestError(HTTPStatus.TOO_MANY_REQUESTS, "model queue is full, retry later")
+
+    def profiled(self, name):
+        if name not in self.profiles:
+            try:
+                get_profile(name)
+            except ValueError as e:
+                raise RequestError(HTTPStatus.BAD_REQUEST, str(e))
+            self.profiles[name] = ProfiledModel(self.clf, name)
+        return self.profiles[name]
+
+    async def predict(self, patient):
+        input_data = check_inputs(patient_to_input(patient))
+        profile = patient.get('profile', DEFAULT_PROFILE)
+        profiled = self.profiled(profile)
+        # Cache and store hold results of the deployment profile only
+        shared = profile == DEFAULT_PROFILE
+        key = self.cache.key(input_data) if shared else (profile, self.cache.key(input_data))
+        result = self.cache.get(key)
+        if result is None and shared and self.store is not None:
+            # SQLite read: off the event loop, like store.put
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self.store.get, input_data)
+            if result is not None:
+                self.cache.put(key, result)
+        if result is None:
+            self.admit()
+            try:
+                async with self.model_slots:
+                    try:
+                        future = profiled.batcher.submit(input_data)
+                    except queue.Full:
+                        raise self.queue_full()
+                    result = to_prediction(*await asyncio.wrap_future(future))
+            finally:
+                self.pending -= 1
+            self.cache.put(key, result)
+            if shared and self.store is not None:
+                self.executor.submit(self.store.put, input_data, result)  # off the event loop
+        return result._asdict()
+
+    async def predict_batch(self, body):
+        patients = body.get('patients') if isinstance(body, dict) else body
+        if not isinstance(patients, list) or not patients:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "expected a non-empty 'patients' list")
+        if len(patients) > MAX_BATCH_ROWS:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"at most {MAX_BATCH_ROWS} patients per batch")
+        profiled = self.profiled(body.get('profile', DEFAULT_PROFILE) if isinstance(body, dict) else DEFAULT_PROFILE)
+        input_data = check_inputs(np.vstack([patient_to_input(p) for p in patients]))
+        self.admit()
+        try:
+            async with self.model_slots:
+                loop = asyncio.get_running_loop()
+                try:
+                    probs, ci_lower, ci_upper = await loop.run_in_executor(
+                        self.executor, profiled.predict_batch, input_data)
+                except queue.Full:
+                    raise self.queue_full()
+        finally:
+            self.pending -= 1
+        return {'predictions': [to_prediction(*row)._asdict() for row in zip(probs, ci_lower, ci_upper)]}
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'rejected': self.rejected,
+            'cache': self.cache.stats(),
+            'store': self.store.stats() if self.store is not None else None,
+            'batcher': self.batcher.stats(),
+            'profiles': {name: p.batcher.stats() for name, p in self.profiles.items()},
+        }
+
+    async def handle(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return HTTPStatus.OK, {'status': 'ok'}
+        if method == 'GET' and path == '/stats':
+            return HTTPStatus.OK, self.stats()
+        if method == 'GET' and path == '/metrics':
+            return HTTPStatus.OK, METRICS.render()
+        if method == 'POST' and path in ('/predict', '/predict/batch'):
+            try:
+                payload = json.loads(body or b'null')
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "body is not valid JSON")
+            if path == '/predict':
+                with METRICS.timer('api_predict'):
+                    return HTTPStatus.OK, await self.predict(payload)
+            with METRICS.timer('api_predict_batch'):
+                return HTTPStatus.OK, await self.predict_batch(payload)
+        raise RequestError(HTTPStatus.NOT_FOUND, f"no route for {method} {path}")
+
+
+async def read_request(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    method, path, version = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request body too large")
+    body = await reader.readexactly(length) if length else b''
+    keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+    return method, path.split('?', 1)[0], body, keep_alive
+
+
+def write_response(writer, status, payload, keep_alive):
+    # str payloads are plain text (the /metrics exposition), everything else JSON
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), "text/plain; version=0.0.4"
+    else:
+        body, content_type = json.dumps(payload).encode(), "application/json"
+    head = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    if status == HTTPStatus.TOO_MANY_REQUESTS:
+        head.append("Retry-After: 1")
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+
+
+def make_handler(service, keepalive_timeout):
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    write_response(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, {'error': "headers too large"}, False)
+                    break
+                except RequestError as e:
+                    write_response(writer, e.status, {'error': str(e)}, False)
+                    break
+                except ValueError:
+                    write_response(writer, HTTPStatus.BAD_REQUEST, {'error': "malformed request"}, False)
+                    break
+                method, path, body, keep_alive = request
+                try:
+                    status, payload = await service.handle(method, path, body)
+                except RequestError as e:
+                    status, payload = e.status, e.payload()
+                except Exception:
+                    logger.exception("prediction failed")
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "internal error"}
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+    return handle_connection
+
+
+async def serve(host, port, service, keepalive_timeout, sock=None):
+    handler = make_handler(service, keepalive_timeout)
+    if sock is not None:
+        server = await asyncio.start_server(handler, sock=sock)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    logger.info("serving on http://%s:%d", *server.sockets[0].getsockname()[:2])
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MDVO prediction JSON API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--workers', type=int, default=2, help="threads for batch predictions")
+    parser.add_argument('--max-concurrency', type=int, default=4, help="model calls in flight")
+    parser.add_argument('--max-pending', type=int, default=64, help="queued requests before 429")
+    parser.add_argument('--keepalive-timeout', type=float, default=15.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    async def run():
+        service = PredictionService(args.model, args.workers, args.max_concurrency, args.max_pending)
+        await serve(args.host, args.port, service, args.keepalive_timeout)
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -13,12 +13,16 @@
 # ---
 
 # %%
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
 import streamlit as st
-import numpy as np
-import joblib
-import gc
+import os
+import queue
+import time
+import uuid
+import weakref
+from concurrent.futures import wait as wait_futures
+from metrics import METRICS, start_exporter
+from predictor import vessel_options, create_input_data, to_prediction
+from prediction_cache import PredictionCache
 
 # MUST BE FIRST - Page config before any Streamlit calls
 st.set_page_config(
@@ -26,6 +30,8 @@ st.set_page_config(
     layout="wide", 
     initial_sidebar_state="expanded"
 )
+run_started = time.perf_counter()
+METRICS.inc('reruns')
 
 # CSS only once
 if not st.session_state.get('css_loaded', False):
@@ -146,57 +152,158 @@ if 'ci_lower' not in st.session_state:
     st.session_state.ci_lower = None
 if 'ci_upper' not in st.session_state:
     st.session_state.ci_upper = None
-if 'plot_fig' not in st.session_state:
-    st.session_state.plot_fig = None
+if 'prediction_source' not in st.session_state:
+    st.session_state.prediction_source = None
 if 'last_computed_hash' not in st.session_state:
     st.session_state.last_computed_hash = None
+if 'pending_prediction' not in st.session_state:
+    st.session_state.pending_prediction = None  # (input hash, Future, monotonic start time) of the in-flight request
+if 'memory_id' not in st.session_state:
+    st.session_state.memory_id = uuid.uuid4().hex
+
+# Session state holds compact values only (floats, hashes, the encoded result
+# image); entries listed here are recomputed when evicted to meet the budget
+EVICTABLE_STATE = ('plot_png',)
+
+# Shown under the headline: which path answered (predictor.Prediction.source)
+PREDICTION_SOURCES = {
+    'model': "the live model",
+    'lookup table': "the precomputed lookup table",
+    'surrogate': "the distilled surrogate model (a fast approximation of the live model)",
+}
+
+# Per-request limit for a model call (seconds)
+PREDICT_TIMEOUT = float(os.environ.get('MDVO_PREDICT_TIMEOUT', 60))
+
+
+def batcher_scorer(batcher, label):
+    # What-if views score through the batcher like the headline request: bounded
+    # queue, PREDICT_TIMEOUT, and queued chunks cancelled when the run is stopped
+    status = st.empty()
+
+    def score(X):
+        try:
+            return batcher.score_rows(X, PREDICT_TIMEOUT, lambda s: status.caption(f"{label}... {s:.1f} s"))
+        finally:
+            status.empty()
+    return score
+
+
+def whatif_failed(e):
+    METRICS.inc('prediction_timeouts' if isinstance(e, TimeoutError) else 'whatif_rejected')
+    st.warning("The model is busy with other requests. Please try again in a moment." if isinstance(e, queue.Full)
+               else f"The model did not finish within {PREDICT_TIMEOUT:.0f} s. Please try again.")
+
+# Models: every *.pkl in MDVO_MODEL_DIR (default: next to the app), described
+# by an optional sidecar JSON (label, threshold). Each one loads on first use
+# in a background thread, so the sidebar renders immediately: the loader
+# precomputes the training context (or loads it from .model_cache) and starts
+# the batching coordinator that lets concurrent sessions share forward passes. Least recently used
+# models are unloaded beyond MDVO_MODEL_MEMORY_MB; a replaced file is swapped
+# in once its new version is ready - see model_registry.py
+@st.cache_resource
+def load_registry():
+    from model_registry import ModelRegistry
+    return ModelRegistry()
+
+registry = load_registry()
+model_names = registry.names()
+model_name = registry.default
+if len(model_names) > 1:
+    model_name = st.sidebar.selectbox("Model", model_names, index=model_names.index(registry.default),
+                                      format_func=lambda name: registry.info(name).label)
+    st.sidebar.markdown("---")
+model_info = registry.info(model_name)
+model = registry.get(model_name)
+
+# Metrics: recorded always, exported via MDVO_METRICS_PORT (/metrics) and/or
+# MDVO_METRICS_LOG_INTERVAL (periodic log line) - see metrics.py
+@st.cache_resource
+def start_metrics():
+    caches = weakref.WeakSet()      # prediction cache of every loaded model, summed below
+
+    def cache_gauges():
+        stats = [cache.stats() for cache in list(caches)]
+        totals = {k: sum(s[k] for s in stats) for k in ('size', 'maxsize', 'hits', 'misses', 'evictions')}
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.0
+        return {f'prediction_cache_{k}': v for k, v in totals.items()}
+
+    def model_gauges():
+        loaded = registry.stats()['loaded']
+        return {'models_loaded': len(loaded), 'models_memory_bytes': sum(m['memory_mb'] for m in loaded.values()) * 2**20}
+
+    METRICS.register_collector(cache_gauges)
+    METRICS.register_collector(model_gauges)
+    start_exporter()
+    return caches
+
+metered_caches = start_metrics()
 
-# Load model ONCE with cache_resource (only model, not figures)
+# Over the RSS limit, process-wide derived caches are dropped before collecting;
+# each model's caches register themselves as they are created
 @st.cache_resource
-def load_model():
-    clf = joblib.load('no_dominant_m2_24h_nihss_cpu.pkl')
-    return clf
-
-clf = load_model()
-
-# Load base image ONCE globally (not cached, not per-user)
-try:
-    base_img = mpimg.imread("Fig2_probabilites_good_outcome.png")
-except:
-    base_img = None
-
-# Lightweight functions - NO CACHING (too small to justify overhead)
-def create_input_data(age, sex_numeric, onset_to_img, nihss, prestroke_mrs, 
-                     antiplatelets_numeric, anticoagulants_numeric, ivt_numeric,
-                     hist_stroke_numeric, hist_tia_numeric, aht_numeric, 
-                     diabetes_numeric, af_numeric, glucose, vessel_numeric, tissue_at_risk):
-    return np.array([[
-        age, sex_numeric, onset_to_img, nihss, prestroke_mrs, 
-        antiplatelets_numeric, anticoagulants_numeric, ivt_numeric,
-        hist_stroke_numeric, hist_tia_numeric, aht_numeric, 
-        diabetes_numeric, af_numeric, glucose, vessel_numeric, tissue_at_risk
-    ]])
-
-def calculate_probs_ci(probs):
-    n_eff = 500
-    se = np.sqrt(probs * (1 - probs) / n_eff)
-    ci_lower = np.maximum(0, probs - 1.96 * se)
-    ci_upper = np.minimum(1, probs + 1.96 * se)
-    return ci_lower, ci_upper
-
-def create_plot(probs, ci_lower, ci_upper):
-    if base_img is None:
+def load_memory_manager():
+    from memory_manager import MemoryManager
+    from plot_overlay import clear_render_cache
+    manager = MemoryManager()
+    manager.register_reclaimer(clear_render_cache)
+    return manager
+
+memory = load_memory_manager()
+
+# Predictions shared across ALL sessions (keyed on inputs + model file version)
+@st.cache_resource(max_entries=16)
+def load_prediction_cache(identity):
+    cache = PredictionCache(maxsize=4096, model_id=identity)
+    metered_caches.add(cache)
+    return cache
+
+pred_cache = load_prediction_cache(model.identity)
+
+@st.cache_resource(max_entries=16)
+def load_curve_cache(identity):
+    from sensitivity import curve_cache
+    cache = curve_cache(identity)
+    memory.register_cache(cache)
+    return cache
+
+curve_cache = load_curve_cache(model.identity)
+
+@st.cache_resource(max_entries=16)
+def load_counterfactual_cache(identity):
+    cache = PredictionCache(maxsize=1024, model_id=identity)
+    memory.register_cache(cache)
+    return cache
+
+counterfactual_cache = load_counterfactual_cache(model.identity)
+
+@st.cache_resource(max_entries=16)
+def load_attribution_cache(identity):
+    from attribution import attribution_cache
+    cache = attribution_cache(identity)
+    memory.register_cache(cache)
+    return cache
+
+attribution_cache = load_attribution_cache(model.identity)
+
+# Opt-in (MDVO_SPECULATE=1): after a result, its one-step neighbours (NIHSS +-1,
+# onset +-30 min, one checkbox toggled) are scored in the background into
+# pred_cache at low priority - see speculative.py. A speculator is stopped when
+# its cache entry is evicted or its model is retired; a stopped one is rebuilt.
+def release_speculator(speculator):
+    if speculator is not None:
+        speculator.close()
+
+@st.cache_resource(max_entries=4, on_release=release_speculator,
+                   validate=lambda speculator: speculator is None or not speculator.closed)
+def load_speculator(identity):
+    from speculative import ENABLED, Speculator
+    if not ENABLED:
         return None
-    plt.close('all')  # Clear any existing figures
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.imshow(base_img, aspect='auto')
-    x_mean = 110 + probs * 800
-    x_lower = 110 + ci_lower * 800
-    x_upper = 110 + ci_upper * 800
-    ax.axvspan(x_lower, x_upper, color='red', alpha=0.3, ymin=0.12)
-    ax.axvline(x_mean, color='red', linewidth=2, linestyle='--', ymin=0.12)
-    ax.axis('off')
-    return fig
+    speculator = Speculator(model.clf, pred_cache, model.batcher, threshold=model_info.threshold)
+    model.on_close(speculator.close)
+    return speculator
 
 # Warning/Disclaimer
 st.markdown("""
@@ -266,7 +373,6 @@ glucose = st.sidebar.number_input("Blood Glucose at admission (mmol/L)", 0.0, 40
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Imaging")
-vessel_options = {"Non-/Co-dominant M2": 4, "M3 and more distal": 5, "A1": 6, "A2 and more distal": 7, "P1": 10, "P2 and more distal": 11}
 occluded_vessel = st.sidebar.selectbox("Occluded Vessel", options=list(vessel_options.keys()), index=0)
 vessel_numeric = vessel_options[occluded_vessel]
 tissue_at_risk = st.sidebar.number_input("Tissue at risk (Tmax>6s, ml)", 0.0, 500.0, 30.0, 0.1)
@@ -289,13 +395,22 @@ aht_numeric = 1 if st.sidebar.checkbox("Arterial Hypertension") else 0
 diabetes_numeric = 1 if st.sidebar.checkbox("Diabetes Mellitus") else 0
 af_numeric = 1 if st.sidebar.checkbox("Atrial Fibrillation") else 0
 
+FEATURE_LABELS = {
+    'age': "Age", 'sex_numeric': "Sex", 'onset_to_img': "Onset to imaging", 'nihss': "NIHSS",
+    'prestroke_mrs': "Prestroke mRS", 'antiplatelets_numeric': "Antiplatelets",
+    'anticoagulants_numeric': "Anticoagulants", 'ivt_numeric': "IVT", 'hist_stroke_numeric': "History of stroke",
+    'hist_tia_numeric': "History of TIA", 'aht_numeric': "Arterial Hypertension", 'diabetes_numeric': "Diabetes Mellitus",
+    'af_numeric': "Atrial Fibrillation", 'glucose': "Blood Glucose", 'vessel_numeric': "Occluded Vessel",
+    'tissue_at_risk': "Tissue at risk",
+}
+
 # Input data
 input_data = create_input_data(age, sex_numeric, onset_to_img, nihss, prestroke_mrs, 
                               antiplatelets_numeric, anticoagulants_numeric, ivt_numeric,
                               hist_stroke_numeric, hist_tia_numeric, aht_numeric,
                               diabetes_numeric, af_numeric, glucose, vessel_numeric, tissue_at_risk)
 
-current_hash = hash(str(input_data))
+current_hash = pred_cache.key(input_data)
 if st.session_state.last_input_hash != current_hash:
     st.session_state.last_input_hash = current_hash
 
@@ -333,19 +448,93 @@ if not st.session_state.prediction_made:
             <p style='color: #e2e8f0; margin: 10px 0 0 0; font-size: 22px;'>Tap » (top-left) to open sidebar</p>
         </div>
     """, unsafe_allow_html=True)
+    if not model.ready:
+        st.caption("Model warming up - predictions will be available in a moment.")
 
 # Results
 if st.session_state.prediction_made:
+    # A request for inputs that are no longer current is cancelled (or, if its
+    # batch already started, its result only goes to the shared cache)
+    pending = st.session_state.pending_prediction
+    if pending is not None and pending[0] != st.session_state.last_input_hash:
+        pending[1].cancel()
+        st.session_state.pending_prediction = pending = None
+
     if st.session_state.last_input_hash != st.session_state.last_computed_hash:
-        # Clear previous plot
-        if st.session_state.plot_fig:
-            plt.close(st.session_state.plot_fig)
-            st.session_state.plot_fig = None
-        
-        st.session_state.probs = clf.predict_proba(input_data)[0, 1]
-        st.session_state.ci_lower, st.session_state.ci_upper = calculate_probs_ci(st.session_state.probs)
-        st.session_state.plot_fig = create_plot(st.session_state.probs, st.session_state.ci_lower, st.session_state.ci_upper)
-        st.session_state.last_computed_hash = st.session_state.last_input_hash
+        with st.spinner("Model warming up..."):
+            model.wait()
+        request_hash = st.session_state.last_input_hash
+        result = pred_cache.get(request_hash)
+        speculator = load_speculator(model.identity)
+        if speculator is not None:
+            speculator.note_lookup(request_hash, result is not None)
+        # Persistent store (prediction_store.py): survives restarts, shared by workers
+        if result is None and pending is None and model.store is not None:
+            result = model.store.get(input_data, model_info.threshold)
+            METRICS.inc('store_hits' if result is not None else 'store_misses')
+            if result is not None:
+                pred_cache.put(request_hash, result)
+        # Fast paths: precomputed table (lookup_table.py, exact or calibrated interpolation),
+        # then the distilled surrogate (surrogate.py) unless it is unsure
+        if result is None and pending is None and model.table is not None:
+            fast = model.table.lookup_one(input_data, model_info.threshold)
+            METRICS.inc('lookup_table_hits' if fast is not None else 'lookup_table_misses')
+            if fast is not None:
+                result = to_prediction(*fast, model_info.threshold, source='lookup table')
+                pred_cache.put(request_hash, result)
+        if result is None and pending is None and model.surrogate is not None:
+            fast = model.surrogate.predict_one(input_data, model_info.threshold)
+            METRICS.inc('surrogate_served' if fast is not None else 'surrogate_fallback')
+            if fast is not None:
+                result = to_prediction(*fast, model_info.threshold, source='surrogate')
+                pred_cache.put(request_hash, result)
+        if result is None:
+            if pending is None:
+                try:
+                    future = model.batcher.submit(input_data)
+                except queue.Full:
+                    st.error("The model is busy with other requests. Please try again in a moment.")
+                    st.stop()
+                METRICS.inc('predictions')
+                # Runs on the batcher thread, so even abandoned results are kept
+                def remember(f, key=request_hash, row=input_data, cache=pred_cache, store=model.store,
+                             threshold=model_info.threshold):
+                    if not f.cancelled() and f.exception() is None:
+                        prediction = to_prediction(*f.result(), threshold)
+                        cache.put(key, prediction)
+                        if store is not None:
+                            store.put(row, prediction)
+                future.add_done_callback(remember)
+                pending = st.session_state.pending_prediction = (request_hash, future, time.monotonic())
+            future, started = pending[1], pending[2]
+            # Poll instead of blocking: each status update lets Streamlit stop this
+            # run as soon as the user changes an input
+            status = st.empty()
+            with METRICS.timer('predict', track_memory=True), st.spinner("Calculating prediction..."):
+                while not future.done() and time.monotonic() - started < PREDICT_TIMEOUT:
+                    status.caption(f"Calculating prediction... {time.monotonic() - started:.1f} s")
+                    wait_futures([future], timeout=0.1)
+            status.empty()
+            st.session_state.pending_prediction = None
+            if not future.done():
+                future.cancel()
+                METRICS.inc('prediction_timeouts')
+                st.error(f"The prediction did not finish within {PREDICT_TIMEOUT:.0f} s. Please try again.")
+                st.stop()
+            if future.exception() is not None:
+                st.error(f"The prediction failed: {future.exception()}")
+                st.stop()
+            result = to_prediction(*future.result(), model_info.threshold)
+        # Only a result for the current inputs ever reaches the session state
+        if request_hash == st.session_state.last_input_hash:
+            st.session_state.probs = result.probs
+            st.session_state.ci_lower, st.session_state.ci_upper = result.ci_lower, result.ci_upper
+            st.session_state.prediction_source = result.source
+            st.session_state.last_computed_hash = request_hash
+            if speculator is not None:
+                speculator.submit(input_data)
+    else:
+        METRICS.inc('session_result_reuse')
     
     probs = st.session_state.probs
     ci_lower = st.session_state.ci_lower
@@ -357,9 +546,10 @@ if st.session_state.prediction_made:
             <h1 style='font-size: 34px; color: #e2e8f0; margin: 0;'><strong>{probs:.1%}</strong> <span style='font-size: 34px;'>(95% CI: {ci_lower:.1%}–{ci_upper:.1%})</span></h1>
         </div>
     """, unsafe_allow_html=True)
+    st.caption(f"Computed by: {PREDICTION_SOURCES.get(st.session_state.prediction_source, 'the model')}")
 
     # Recommendation
-    if ci_lower > 0.23:
+    if ci_lower > model_info.threshold:
         st.markdown(f"""
             <div style='background-color: #fee2e2; padding: 20px; border-radius: 12px; 
                 border-left: 6px solid #dc2626; margin: 20px 0; text-align: center;
@@ -378,31 +568,98 @@ if st.session_state.prediction_made:
             </div>
         """, unsafe_allow_html=True)
         
-    # Plot with proper cleanup
+    # Plot: base image decoded once per process, renders cached per 0.1% step
+    # (imported here so the plotting stack loads only when a result is shown)
+    from plot_overlay import render_png
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        if st.session_state.plot_fig:
-            st.pyplot(st.session_state.plot_fig)
-            # Critical: close figure after display to free memory
-            plt.close(st.session_state.plot_fig)
-            st.session_state.plot_fig = None
-        else:
+        try:
+            cached_png = st.session_state.get('plot_png')
+            if cached_png is not None and cached_png[0] == st.session_state.last_computed_hash:
+                png = cached_png[1]
+            else:
+                with METRICS.timer('render_plot', track_memory=True):
+                    png = render_png(probs, ci_lower, ci_upper)
+                st.session_state.plot_png = (st.session_state.last_computed_hash, png)
+            st.image(png)
+        except OSError:
             st.warning("Prediction visualization image not found.")
 
+    # The what-if curve runs under MDVO_WHATIF_PROFILE (e.g. "fast"); the headline,
+    # the counterfactual recommendations and attributions under the deployment's
+    # MDVO_PROFILE - see inference_profiles.py
+    # The loader can be new here (reloaded after an eviction, or after a swap) even
+    # when the headline came from session state, so wait for it like the headline does
+    from inference_profiles import WHATIF_PROFILE
+    with st.spinner("Model warming up..."):
+        model.wait()
+    whatif = model.profiled(WHATIF_PROFILE)
+    whatif_note = "" if whatif.name == model.profile_name else f" Computed with the '{whatif.name}' inference profile."
+
+    # What-if: sweep one feature over its widget range in a single batched call;
+    # curves cached per patient profile (shared across sessions)
+    from sensitivity import SWEEPS, cached_curve, curve_chart
+    with st.expander("What-if: sensitivity to one feature"):
+        sweep_feature = st.radio("Vary", [None, *SWEEPS], horizontal=True, key="sweep_feature",
+                                 format_func=lambda f: "Off" if f is None else SWEEPS[f][0])
+        if sweep_feature is not None:
+            try:
+                curve = cached_curve(curve_cache, whatif.clf, input_data, sweep_feature,
+                                     score=batcher_scorer(whatif.batcher, "Computing the curve"))
+            except (queue.Full, TimeoutError) as e:
+                whatif_failed(e)
+            else:
+                current_value = {'onset_to_img': onset_to_img, 'nihss': nihss, 'tissue_at_risk': tissue_at_risk}[sweep_feature]
+                st.altair_chart(curve_chart(curve, current_value, model_info.threshold))
+                st.caption(f"Shaded: 95% CI. Dotted: CI lower bound; red dashed: EVT threshold ({model_info.threshold:.0%}) - "
+                           "EVT Not Recommended where the CI lower bound is above it." + whatif_note)
+
+    # Counterfactuals: IVT yes/no x every vessel, scored together in one batched call
+    from counterfactual import cached_variants, counterfactual_table
+    with st.expander("What-if: IVT and occluded vessel alternatives"):
+        if st.toggle("Compare all IVT / vessel combinations", key="show_counterfactuals"):
+            try:
+                scored = cached_variants(counterfactual_cache, model.clf, input_data, model_info.threshold,
+                                         score=batcher_scorer(model.batcher, "Scoring the alternatives"))
+            except (queue.Full, TimeoutError) as e:
+                whatif_failed(e)
+            else:
+                st.dataframe(counterfactual_table(scored, ivt_selection, occluded_vessel), hide_index=True)
+
+    # Explanation: Shapley attributions, coalitions scored in a few large batches,
+    # cached per input vector and budget
+    from attribution import attribution_chart, cached_explanation
+    with st.expander("Why this prediction? (feature attributions)"):
+        if st.toggle("Explain this prediction", key="show_attributions"):
+            budget = st.select_slider("Sample budget (model evaluations) - higher is more accurate but slower",
+                                      options=[512, 2048, 8192, 32768], value=2048, key="shap_budget")
+            score = batcher_scorer(model.batcher, "Computing attributions")
+            try:
+                phi, base_value, fx = cached_explanation(attribution_cache, model.explainer, input_data, budget,
+                                                         score=lambda X: score(X)[0])
+            except (queue.Full, TimeoutError) as e:
+                whatif_failed(e)
+            else:
+                st.altair_chart(attribution_chart(phi, FEATURE_LABELS))
+                note = ("" if st.session_state.prediction_source in (None, 'model') else
+                        f" The headline above came from the {st.session_state.prediction_source}, so it can differ"
+                        " slightly from this value.")
+                st.caption(f"Average prediction over {model.explainer.background_label}: {base_value:.1%}. "
+                           f"Contributions add up to the live model's {fx:.1%} for this patient (point estimate, "
+                           f"without the CI).{note}")
+
     # PERFECTLY CENTERED RESET BUTTON
     st.markdown('<div class="reset-container">', unsafe_allow_html=True)
     st.markdown('<div class="reset-button-container">', unsafe_allow_html=True)
     if st.button("New Prediction", key="reset_btn"):
-        # Full reset - clear all session state
+        # Full reset - clear all session state (and drop any in-flight request)
+        if st.session_state.pending_prediction is not None:
+            st.session_state.pending_prediction[1].cancel()
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
     st.markdown('</div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Aggressive memory cleanup
-    del input_data
-    gc.collect()
 
 # Info section
 st.markdown("---")
@@ -415,13 +672,15 @@ with st.expander("More information about this model"):
     - Recommendations regarding EVT are derived from predictive Heterogeneity of Treatment Effect (HTE) analysis from patients of the DISTAL trial.
 
     **Confidence intervals (CI)**
-    - The 95% CI are derived using bootstrapping with 1000 iterations.  
+    - The 95% CI is the normal-approximation (Wald) interval of the predicted probability with an effective sample size of 500. The recommendation compares its lower bound with the HTE threshold.  
 
     Use in conjunction with clinical expertise and current guideline recommendations.
     """)
 
-# Final cleanup
-gc.collect()
+# Memory: size this session's state; evict / collect only over budget (see memory_manager.py)
+with METRICS.timer('memory_check'):
+    memory.track(st.session_state.memory_id, st.session_state, EVICTABLE_STATE)
+METRICS.observe('script_run', time.perf_counter() - run_started)
 
 
 # %%
@@ -0,0 +1,128 @@
+"""Per-prediction Shapley attributions for the 16 model inputs.
+
+Permutation sampling with an interventional background: each sampled
+permutation walks from a background patient to the current one, switching
+one feature at a time, and every feature's marginal contribution is the
+change in P(good outcome) at its step. Permutations come in antithetic
+pairs (a permutation and its reverse) for lower variance. All walks are
+stacked into one matrix and scored in a few large predict_proba calls.
+
+Attributions sum exactly to f(x) minus the mean prediction over the
+background rows the walks started from. The background set and its mean
+prediction are computed once, when the model is loaded:
+
+    MDVO_SHAP_BACKGROUND=cohort.csv   # real patients (CSV/Parquet, FEATURES columns)
+
+Otherwise a fixed synthetic sample over the widget ranges is used.
+"""
+import os
+
+import numpy as np
+
+from metrics import METRICS
+from prediction_cache import PredictionCache
+from predictor import FEATURES, sample_inputs
+
+BACKGROUND_SIZE = 32
+DEFAULT_BUDGET = 2048       # model evaluations (rows) per explanation
+MAX_ROWS_PER_CALL = 8192
+
+
+def background_label(path=None):
+    # How the reference patients were chosen, for captions
+    path = path or os.environ.get('MDVO_SHAP_BACKGROUND')
+    if path:
+        return f"reference patients from {os.path.basename(path)}"
+    return "synthetic patients drawn uniformly over the input ranges"
+
+
+def default_background(path=None, n=BACKGROUND_SIZE, seed=0):
+    path = path or os.environ.get('MDVO_SHAP_BACKGROUND')
+    if not path:
+        return sample_inputs(n, seed=seed)
+    from batch_predict import iter_chunks, rows_to_matrix
+
+    X = np.vstack([rows_to_matrix(chunk) for chunk in iter_chunks(path, 4096)])
+    if len(X) > n:
+        X = X[np.random.default_rng(seed).choice(len(X), n, replace=False)]
+    return X
+
+
+def _positive_class(clf, X):
+    return clf.predict_proba(X)[:, 1]
+
+
+class ShapleyExplainer:
+    def __init__(self, clf, background=None, predict=_positive_class, max_rows_per_call=MAX_ROWS_PER_CALL):
+        self.clf = clf
+        self.predict = predict
+        self.max_rows_per_call = max_rows_per_call
+        self.background = np.asarray(background if background is not None else default_background(), dtype=float)
+        self.background_label = "the given background patients" if background is not None else background_label()
+        self.base_value = float(np.mean(self._score(self.background)))
+        self.n_evaluations = 0
+
+    def _score(self, X, score=None):
+        # score: X -> probabilities, e.g. through the batcher (it splits X itself)
+        if score is not None:
+            return np.asarray(score(X))
+        return np.concatenate([self.predict(self.clf, X[i:i + self.max_rows_per_call])
+                               for i in range(0, len(X), self.max_rows_per_call)])
+
+    def coalition_matrix(self, x, n_samples, seed=0):
+        # -> (rows, ranks): rows are (n_perm, d + 1, d) walks, ranks[k, f] = step at which f switches to x
+        d = len(x)
+        n_perm = max(2, n_samples // (d + 1)) // 2 * 2
+        rng = np.random.default_rng(seed)
+        perms = np.argsort(rng.random((n_perm // 2, d)), axis=1)
+        perms = np.concatenate([perms, perms[:, ::-1]])
+        ranks = np.argsort(perms, axis=1)
+        # Background rows used in turn (stratified), so every reference patient is covered
+        start = self.background[rng.permutation(np.arange(n_perm // 2) % len(self.background))]
+        start = np.concatenate([start, start])
+        switched = ranks[:, None, :] < np.arange(d + 1)[None, :, None]
+        rows = np.where(switched, x[None, None, :], start[:, None, :])
+        return rows, ranks
+
+    def explain(self, input_data, n_samples=DEFAULT_BUDGET, seed=0, score=None):
+        """-> (attributions over FEATURES, base value, f(x)); n_samples is the evaluation budget."""
+        x = np.asarray(input_data, dtype=float).reshape(-1)
+        rows, ranks = self.coalition_matrix(x, n_samples, seed)
+        n_perm, steps, d = rows.shape
+        with METRICS.timer('shapley'):
+            f = self._score(rows.reshape(-1, d), score).reshape(n_perm, steps)
+        self.n_evaluations += f.size
+        deltas = np.diff(f, axis=1)                        # contribution of the feature switched at each step
+        phi = np.take_along_axis(deltas, ranks, axis=1).mean(axis=0)
+        # Base value of the sampled walks, so the attributions add up exactly
+        return phi, float(f[:, 0].mean()), float(f[0, -1])
+
+
+def attribution_cache(model_id, maxsize=512):
+    return PredictionCache(maxsize=maxsize, model_id=model_id)
+
+
+def cached_explanation(cache, explainer, input_data, n_samples=DEFAULT_BUDGET, score=None):
+    key = (cache.model_id, 'shapley', n_samples, cache.key(input_data)[1])
+    result = cache.get(key)
+    if result is None:
+        result = explainer.explain(input_data, n_samples, score=score)
+        cache.put(key, result)
+    return result
+
+
+def attribution_chart(phi, feature_labels=None):
+    """Altair bar chart, largest absolute attribution first."""
+    import altair as alt
+    import pandas as pd
+
+    labels = [feature_labels.get(f, f) if feature_labels else f for f in FEATURES]
+    data = pd.DataFrame({'feature': labels, 'attribution': phi,
+                         'direction': np.where(phi >= 0, "raises probability", "lowers probability")})
+    data = data.reindex(data['attribution'].abs().sort_values(ascending=False).index)
+    return alt.Chart(data).mark_bar().encode(
+        x=alt.X('attribution:Q', title="Change in probability", axis=alt.Axis(format='+%')),
+        y=alt.Y('feature:N', sort=None, title=None),
+        color=alt.Color('direction:N', scale=alt.Scale(domain=["raises probability", "lowers probability"],
+                                                       range=['#16a34a', '#dc2626']), legend=None),
+        tooltip=['feature:N', alt.Tooltip('attribution:Q', format='+.2%')])
@@ -0,0 +1,154 @@
+"""Headless cohort scoring.
+
+Streams a CSV or Parquet cohort through the model in fixed-size chunks and
+writes probability, CI and EVT recommendation row by row, so memory stays
+flat regardless of cohort size. The recommendation uses the model's own
+threshold (its sidecar JSON, see model_registry.py) unless --threshold is
+given. Cells outside the schema are scored with a warning; --validate makes
+them an error.
+
+    python batch_predict.py cohort.csv scored.csv --chunk-size 1024 --id-column case_id
+    python batch_predict.py cohort.csv scored.csv --store     # also prefill the prediction store
+    python batch_predict.py cohort.csv scored.csv --validate  # refuse cells outside the schema ranges
+    python batch_predict.py cohort.csv scored.csv --model other.pkl --threshold 0.25
+"""
+import argparse
+import csv
+import itertools
+import sys
+
+import numpy as np
+
+from patient_schema import encode_columns, format_report, validate
+from predictor import MODEL_PATH, FEATURES, EVT_THRESHOLD, load_clf, predict_batch, evt_recommendation
+
+OUTPUT_COLUMNS = ['probs', 'ci_lower', 'ci_upper', 'recommendation']
+
+
+def rows_to_matrix(rows, strict=False, warn=False, first_row=0):
+    # rows: list of dicts keyed by feature name -> (n, 16) float matrix in model order.
+    # Blank or unparseable cells are always an error; strict also rejects values outside
+    # the schema, warn only reports them on stderr (report rows count from first_row)
+    columns = {f: [row[f] for row in rows] for f in FEATURES}
+    X = encode_columns(columns)
+    blank = np.isnan(X).any()
+    if strict or warn or blank:
+        report = validate(X, raw=columns)
+        if not report.ok:
+            if strict or blank:
+                raise ValueError(f"Invalid cohort cells:\n{format_report(report)}")
+            print(f"Warning: cells outside the schema in cohort rows {first_row}-{first_row + len(rows) - 1} "
+                  f"(report rows count from {first_row}), scored anyway; --validate to stop:\n"
+                  f"{format_report(report)}", file=sys.stderr)
+    return X
+
+
+def check_columns(columns, id_column=None):
+    missing = [f for f in FEATURES if f not in columns]
+    if id_column and id_column not in columns:
+        missing.append(id_column)
+    if missing:
+        raise ValueError(f"Cohort file is missing columns: {', '.join(missing)}")
+
+
+def iter_csv_chunks(path, chunk_size, id_column=None):
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        check_columns(reader.fieldnames or [], id_column)
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def iter_parquet_chunks(path, chunk_size, id_column=None):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet cohorts requires pyarrow (pip install pyarrow)")
+    parquet_file = pq.ParquetFile(path)
+    check_columns(parquet_file.schema_arrow.names, id_column)
+    columns = FEATURES + ([id_column] if id_column else [])
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pylist()
+
+
+def iter_chunks(path, chunk_size, id_column=None):
+    if str(path).lower().endswith(('.parquet', '.pq')):
+        return iter_parquet_chunks(path, chunk_size, id_column)
+    return iter_csv_chunks(path, chunk_size, id_column)
+
+
+def score_chunks(clf, chunks, strict=False, warn=False):
+    # Yields (rows, X, probs, ci_lower, ci_upper) per chunk; one forward pass per chunk
+    first_row = 0
+    for rows in chunks:
+        X = rows_to_matrix(rows, strict, warn, first_row)
+        probs, ci_lower, ci_upper = predict_batch(clf, X)
+        yield rows, X, probs, ci_lower, ci_upper
+        first_row += len(rows)
+
+
+def score_cohort(clf, input_path, output_path, chunk_size=1024, id_column=None, store=None,
+                 strict=False, threshold=EVT_THRESHOLD):
+    n_rows = 0
+    chunks = iter_chunks(input_path, chunk_size, id_column)
+    # Pull the first chunk before touching the output so bad input leaves it alone
+    first = next(chunks, None)
+    chunks = itertools.chain([first], chunks) if first is not None else iter(())
+    with open(output_path, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(([id_column] if id_column else []) + OUTPUT_COLUMNS)
+        for rows, X, probs, ci_lower, ci_upper in score_chunks(clf, chunks, strict, warn=not strict):
+            for row, p, lo, hi in zip(rows, probs, ci_lower, ci_upper):
+                prefix = [row[id_column]] if id_column else []
+                writer.writerow(prefix + [f"{p:.6f}", f"{lo:.6f}", f"{hi:.6f}", evt_recommendation(lo, threshold)])
+            if store is not None:
+                store.put_many(X, probs, ci_lower, ci_upper)
+            n_rows += len(rows)
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score an MDVO cohort file (CSV or Parquet) in chunks.")
+    parser.add_argument('input', help="cohort file with one column per model feature")
+    parser.add_argument('output', help="CSV file to write predictions to")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    parser.add_argument('--id-column', default=None, help="column copied through to the output")
+    parser.add_argument('--store', nargs='?', const='', default=None, metavar='PATH',
+                        help="also write predictions to the persistent store (default path if omitted)")
+    parser.add_argument('--validate', action='store_true',
+                        help="stop on cells outside the allowed ranges or codes (see patient_schema.py); "
+                             "without it they are scored with a warning")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="EVT decision threshold (default: the model's sidecar JSON, else the app default)")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    if args.threshold is None:
+        from model_registry import read_model_info
+        try:
+            args.threshold = read_model_info(args.model).threshold
+        except ValueError as e:
+            parser.error(str(e))
+
+    clf = load_clf(args.model)
+    store = None
+    if args.store is not None:
+        from prediction_store import PredictionStore
+        store = PredictionStore.for_model(args.model, args.store or None)
+    try:
+        n_rows = score_cohort(clf, args.input, args.output, args.chunk_size, args.id_column, store,
+                              args.validate, args.threshold)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Scored {n_rows} rows -> {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Per-patient result graphics for a scored cohort, rendered in parallel.
+
+Reads the output of batch_predict.py and writes one PNG (or one-page PDF)
+per patient: the app's result graphic with the CI band and mean line, plus
+a caption with the probability, its 95% CI and the EVT recommendation.
+Ids that map to the same file name (repeated, or equal after replacing
+unsafe characters) get a _2, _3, ... suffix instead of overwriting.
+Rows are split into chunks over a process pool; each worker decodes the
+base figure once at start-up and writes its pages straight to disk, so only
+row values and counts cross process boundaries.
+
+    python batch_report.py scored.csv reports/ --id-column case_id
+    python batch_report.py scored.csv reports/ --format pdf --workers 4 --chunk-size 32
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from plot_overlay import DISPLAY_WIDTH, composite, load_base
+from predictor import IMAGE_PATH, EVT_THRESHOLD, evt_recommendation
+
+FORMATS = ('png', 'pdf')
+CAPTION_HEIGHT = 110
+TEXT = (51, 65, 85)
+HARM = (220, 38, 38)            # "EVT Not Recommended", as in the app
+PDF_RESOLUTION = 100.0
+
+_worker = {}                    # per process: decoded base image and fonts
+
+
+def _load_font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:           # Pillow < 10.1: fixed-size bitmap font only
+        return ImageFont.load_default()
+
+
+def init_worker(image_path=IMAGE_PATH, width=DISPLAY_WIDTH):
+    _worker['base'] = load_base(image_path, width)
+    _worker['fonts'] = (_load_font(18), _load_font(26))
+
+
+def safe_name(value):
+    return re.sub(r'[^\w.-]', '_', str(value)).strip('.') or '_'
+
+
+def render_page(base, fonts, patient_id, probs, ci_lower, ci_upper, recommendation):
+    """PIL image of one patient's graphic with the caption underneath."""
+    figure = composite(base, probs, ci_lower, ci_upper)
+    height, width = figure.shape[:2]
+    page = Image.new('RGB', (width, height + CAPTION_HEIGHT), 'white')
+    page.paste(Image.fromarray(figure), (0, 0))
+    draw = ImageDraw.Draw(page)
+    small, large = fonts
+    y = height + 10
+    if patient_id is not None:
+        draw.text((width // 2, y), str(patient_id), fill=TEXT, font=small, anchor='mt')
+    draw.text((width // 2, y + 26), f"{probs:.1%} (95% CI: {ci_lower:.1%} - {ci_upper:.1%})",
+              fill=TEXT, font=large, anchor='mt')
+    colour = HARM if recommendation == "EVT Not Recommended" else TEXT
+    draw.text((width // 2, y + 64), recommendation, fill=colour, font=large, anchor='mt')
+    return page
+
+
+def render_chunk(task):
+    """Worker entry: render and write one chunk of rows -> (pages written, CPU seconds)."""
+    output_dir, fmt, rows = task
+    start = time.process_time()
+    base, fonts = _worker['base'], _worker['fonts']
+    for name, patient_id, probs, ci_lower, ci_upper, recommendation in rows:
+        page = render_page(base, fonts, patient_id, probs, ci_lower, ci_upper, recommendation)
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        if fmt == 'pdf':
+            page.save(path, format='PDF', resolution=PDF_RESOLUTION)
+        else:
+            page.save(path, format='PNG', compress_level=1)
+    return len(rows), time.process_time() - start
+
+
+def iter_rows(path, id_column=None, threshold=EVT_THRESHOLD):
+    # Scored rows -> (file name, id, probs, ci_lower, ci_upper, recommendation)
+    used = set()                # lower case: case-insensitive file systems collide too
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        columns = reader.fieldnames or []
+        missing = [c for c in ('probs', 'ci_lower', 'ci_upper') + ((id_column,) if id_column else ())
+                   if c not in columns]
+        if missing:
+            raise ValueError(f"Scored file is missing columns: {', '.join(missing)}")
+        for i, row in enumerate(reader):
+            probs, ci_lower, ci_upper = (float(row[c]) for c in ('probs', 'ci_lower', 'ci_upper'))
+            recommendation = row.get('recommendation') or evt_recommendation(ci_lower, threshold)
+            patient_id = row[id_column] if id_column else None
+            name = base = safe_name(patient_id) if id_column else f"patient_{i:06d}"
+            n = 1
+            while name.lower() in used:
+                n += 1
+                name = f"{base}_{n}"
+            if n > 1:
+                print(f"row {i}: file name of id {patient_id!r} already used, writing it as {name}", file=sys.stderr)
+            used.add(name.lower())
+            yield name, patient_id, probs, ci_lower, ci_upper, recommendation
+
+
+def render_cohort(input_path, output_dir, fmt='png', workers=None, chunk_size=16, id_column=None,
+                  image_path=IMAGE_PATH, threshold=EVT_THRESHOLD):
+    """Render every row of a scored file; -> (pages, wall seconds, worker CPU seconds, workers)."""
+    workers = workers or os.cpu_count() or 1
+    rows = iter_rows(input_path, id_column, threshold)
+    first = next(rows, None)    # fail on a bad header before creating anything
+    # Decode here first too: a missing image raises now instead of crashing
+    # every pool worker in its initializer
+    init_worker(image_path)
+    os.makedirs(output_dir, exist_ok=True)
+    rows = itertools.chain([first], rows) if first is not None else iter(())
+    tasks = ((output_dir, fmt, chunk) for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []))
+
+    start = time.perf_counter()
+    pages, cpu = 0, 0.0
+    if workers == 1:
+        for n, seconds in map(render_chunk, tasks):
+            pages += n
+            cpu += seconds
+    else:
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(image_path,)) as pool:
+            for n, seconds in pool.imap_unordered(render_chunk, tasks):
+                pages += n
+                cpu += seconds
+    return pages, time.perf_counter() - start, cpu, workers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render one result graphic per patient of a scored cohort.")
+    parser.add_argument('input', help="scored CSV from batch_predict.py (probs, ci_lower, ci_upper columns)")
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=16, help="rows per task")
+    parser.add_argument('--id-column', default=None, help="column used for the caption and file names")
+    parser.add_argument('--image', default=IMAGE_PATH)
+    parser.add_argument('--threshold', type=float, default=EVT_THRESHOLD,
+                        help="EVT threshold when the file has no recommendation column")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1 or (args.workers is not None and args.workers < 1):
+        parser.error("--workers and --chunk-size must be positive")
+    try:
+        pages, wall, cpu, workers = render_cohort(args.input, args.output_dir, args.format, args.workers,
+                                                  args.chunk_size, args.id_column, args.image, args.threshold)
+    except ValueError as e:
+        parser.error(str(e))
+    except OSError as e:
+        parser.error(f"cannot render: {e}")
+    print(f"Rendered {pages} pages -> {args.output_dir} in {wall:.2f} s with {workers} workers: "
+          f"{pages / wall if wall else 0:.1f} pages/s, {pages / cpu if cpu else 0:.1f} pages/s per core",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
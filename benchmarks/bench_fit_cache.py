@@ -0,0 +1,64 @@
+"""Cold vs warm TabPFN latency for a single-row prediction.
+
+    python -m benchmarks.bench_fit_cache [--model no_dominant_m2_24h_nihss_cpu.pkl]
+
+cold:  model as pickled (training set re-encoded on every call)
+warm:  after fit_cache.warm_context (cached training-set key/values)
+disk:  time to build the warm context vs. load it from the versioned file
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from fit_cache import context_path, context_version, is_tabpfn, load_warm_model, warm_context
+from predictor import MODEL_PATH, DEFAULT_INPUT, create_input_data, load_clf
+
+
+def median_latency(clf, x, repeat):
+    clf.predict_proba(x)  # warm-up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        clf.predict_proba(x)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    x = create_input_data(*DEFAULT_INPUT)
+    clf = load_clf(args.model)
+    if not is_tabpfn(clf):
+        print("not a TabPFN model - nothing to warm")
+        return
+    cold = median_latency(clf, x, args.repeat)
+    probs_cold = clf.predict_proba(x)[0, 1]
+
+    start = time.perf_counter()
+    warm_context(clf)
+    t_build = time.perf_counter() - start
+    warm = median_latency(clf, x, args.repeat)
+    probs_warm = clf.predict_proba(x)[0, 1]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        load_warm_model(args.model, cache_dir)  # writes the context file
+        start = time.perf_counter()
+        load_warm_model(args.model, cache_dir)
+        t_load = time.perf_counter() - start
+        print(f"context file: {context_path(args.model, context_version(args.model), cache_dir)}")
+
+    print(f"cold predict_proba   {cold * 1e3:9.1f} ms")
+    print(f"warm predict_proba   {warm * 1e3:9.1f} ms   ({cold / warm:.1f}x)")
+    print(f"build context        {t_build * 1e3:9.1f} ms")
+    print(f"load context file    {t_load * 1e3:9.1f} ms")
+    print(f"|probs cold - warm|  {abs(probs_cold - probs_warm):.2e}")
+
+
+if __name__ == '__main__':
+    main()
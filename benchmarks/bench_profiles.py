@@ -0,0 +1,60 @@
+"""Inference profiles: latency, CPU use and drift against "full".
+
+    python -m benchmarks.bench_profiles [--model no_dominant_m2_24h_nihss_cpu.pkl] [--samples 512]
+
+For each profile and batch size it reports the median latency of one call
+and the CPU time per wall second (cores busy), then the drift of probs and
+ci_lower against the full profile on --samples random patients and how
+often the EVT recommendation agrees with it.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from fit_cache import load_warm_model
+from inference_profiles import PROFILES, ProfiledModel
+from predictor import MODEL_PATH, EVT_THRESHOLD, sample_inputs
+
+BATCH_SIZES = (1, 64)
+
+
+def timed(fn, repeat):
+    fn()  # warm-up
+    wall, cpu = [], []
+    for _ in range(repeat):
+        w, c = time.perf_counter(), time.process_time()
+        fn()
+        wall.append(time.perf_counter() - w)
+        cpu.append(time.process_time() - c)
+    return np.median(wall), sum(cpu) / sum(wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--samples', type=int, default=512)
+    args = parser.parse_args()
+
+    clf = load_warm_model(args.model)
+    profiled = {name: ProfiledModel(clf, name) for name in PROFILES}
+    X = sample_inputs(args.samples, seed=7)
+    reference = np.column_stack(profiled['full'].predict_batch(X))
+
+    for name, model in profiled.items():
+        line = [f"{name:9s}"]
+        for n in BATCH_SIZES:
+            latency, cores = timed(lambda: model.predict_batch(X[:n]), args.repeat)
+            line.append(f"batch={n:3d} {latency * 1e3:8.2f} ms {cores:4.1f} cores")
+        out = np.column_stack(model.predict_batch(X))
+        drift = np.abs(out - reference)
+        agree = np.mean((out[:, 1] > EVT_THRESHOLD) == (reference[:, 1] > EVT_THRESHOLD))
+        line.append(f"max|dp|={drift[:, 0].max():.4f} mean|dp|={drift[:, 0].mean():.4f} "
+                    f"max|d ci_lower|={drift[:, 1].max():.4f} decisions agree {agree:.1%}")
+        print('  '.join(line))
+        model.batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Shapley attribution throughput (model evaluations per second) per sample budget.
+
+    python -m benchmarks.bench_shapley [--model no_dominant_m2_24h_nihss_cpu.pkl]
+
+For each budget it reports the latency of one explanation, the evaluation
+rate, and how far the attributions are from a 4x larger budget (max abs
+difference), i.e. what a smaller budget costs in accuracy.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from attribution import ShapleyExplainer
+from predictor import MODEL_PATH, DEFAULT_INPUT, create_input_data, load_clf
+
+BUDGETS = (512, 2048, 8192, 32768)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    clf = load_clf(args.model)
+    start = time.perf_counter()
+    explainer = ShapleyExplainer(clf)
+    print(f"background ({len(explainer.background)} rows) scored in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    x = create_input_data(*DEFAULT_INPUT)
+
+    for budget in BUDGETS:
+        explainer.explain(x, budget)  # warm-up
+        times = []
+        evaluated = explainer.n_evaluations
+        for seed in range(args.repeat):
+            t = time.perf_counter()
+            phi, _, _ = explainer.explain(x, budget, seed=seed)
+            times.append(time.perf_counter() - t)
+        n_eval = (explainer.n_evaluations - evaluated) // args.repeat
+        reference, _, _ = explainer.explain(x, budget * 4, seed=1000)
+        t = np.median(times)
+        print(f"budget={budget:6d}  evals={n_eval:6d}  {t * 1e3:9.1f} ms  {n_eval / t:12,.0f} evals/s  "
+              f"max|phi - phi_4x|={np.abs(phi - reference).max():.4f}")
+
+
+if __name__ == '__main__':
+    main()
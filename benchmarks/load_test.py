@@ -0,0 +1,318 @@
+"""Concurrent-session load test of the real app.py flow (offline, localhost).
+
+    python -m benchmarks.load_test [--levels 1,2,4,8,16] [--duration 60] [--think 2.0] [--cores 4] [-o load.json]
+    python -m benchmarks.load_test --url ws://127.0.0.1:8501 --pid 1234    # an already running server
+
+Needs the dev requirements (pip install -r requirements-dev.txt).
+
+Starts `streamlit run app.py` on a free localhost port (unless --url is
+given) and drives it with websocket clients speaking the browser's protocol
+(Streamlit's own BackMsg/ForwardMsg protobufs). Each simulated session
+opens the page, sets every sidebar widget to a random value in its range,
+clicks "Predict Outcome", reads the probability and clicks "New
+Prediction", with exponential think times between the steps. AppTest is
+not used: it keeps one Streamlit runtime per process, so concurrent
+sessions would not be independent.
+
+Concurrency ramps through --levels; each level reports prediction
+throughput, latency percentiles per step, the error rate, server CPU
+cores busy and server RSS growth. The saturation point is the first level
+whose throughput gains less than 10% over the previous one (or that
+starts failing). --cores pins the server to that many CPUs (Linux) to
+size per core count.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from predictor import FEATURES, LABEL_CODES, sample_inputs
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+NUMBER_INPUTS = {
+    'age': "Age", 'nihss': "NIHSS at admission", 'prestroke_mrs': "Prestroke mRS",
+    'glucose': "Blood Glucose at admission (mmol/L)", 'tissue_at_risk': "Tissue at risk (Tmax>6s, ml)",
+    'onset_to_img': "Time from onset to imaging (min)",
+}
+CHECKBOXES = {
+    'antiplatelets_numeric': "Antiplatelets", 'anticoagulants_numeric': "Anticoagulants",
+    'hist_stroke_numeric': "History of stroke", 'hist_tia_numeric': "History of TIA",
+    'aht_numeric': "Arterial Hypertension", 'diabetes_numeric': "Diabetes Mellitus", 'af_numeric': "Atrial Fibrillation",
+}
+SELECTBOXES = {'sex_numeric': "Sex", 'vessel_numeric': "Occluded Vessel"}
+IVT_RADIO = ""     # the IVT radio's label is collapsed
+WIDGET_TYPES = ('number_input', 'button', 'checkbox', 'selectbox', 'radio')
+SATURATION_GAIN = 0.10
+_PROBABILITY = re.compile(r'<strong>([\d.]+)%</strong>')
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class ScriptError(Exception):
+    pass
+
+
+class Session:
+    """One browser tab: a websocket to the app and the widgets of its last run."""
+
+    def __init__(self, ws, timeout):
+        self.ws = ws
+        self.timeout = timeout
+        self.widgets = {}       # label -> (type, proto)
+        self.values = {}        # widget id -> WidgetState the "browser" keeps sending
+        self.markdown = []
+
+    def run(self, triggers=()):
+        """One script run (following any st.rerun); raises ScriptError on an exception or st.error."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.widget_states.widgets.extend(list(self.values.values()) +
+                                                      [WidgetState(id=self.widgets[label][1].id, trigger_value=True)
+                                                       for label in triggers])
+        self.ws.send(msg.SerializeToString())
+        self.markdown = []
+        errors = []
+        deadline = time.monotonic() + self.timeout
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(self.ws.recv(timeout=max(0.0, deadline - time.monotonic())))
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                etype = element.WhichOneof('type')
+                if etype in WIDGET_TYPES:
+                    widget = getattr(element, etype)
+                    self.widgets[widget.label] = (etype, widget)
+                elif etype == 'markdown':
+                    self.markdown.append(element.markdown.body)
+                elif etype == 'exception':
+                    errors.append(f"exception: {element.exception.message}")
+                elif etype == 'alert' and element.alert.format == 1:   # st.error
+                    errors.append(f"error: {element.alert.body}")
+            elif kind == 'script_finished' and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                if errors or forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise ScriptError(errors[0] if errors else "compile error")
+                return
+
+    def set_inputs(self, row):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        def state(label, **value):
+            widget = self.widgets[label][1]
+            self.values[widget.id] = WidgetState(id=widget.id, **value)
+
+        for feature, label in NUMBER_INPUTS.items():
+            value = row[FEATURES.index(feature)]
+            if self.widgets[label][1].data_type == 0:     # INT
+                state(label, int_value=int(value))
+            else:
+                state(label, double_value=round(float(value), 1))
+        for feature, label in SELECTBOXES.items():
+            names = {code: name for name, code in LABEL_CODES[feature].items()}
+            state(label, string_value=names[row[FEATURES.index(feature)]])
+        ivt = {code: name for name, code in LABEL_CODES['ivt_numeric'].items()}
+        state(IVT_RADIO, string_value=ivt[row[FEATURES.index('ivt_numeric')]])
+        for feature, label in CHECKBOXES.items():
+            state(label, bool_value=bool(row[FEATURES.index(feature)]))
+
+    def probability(self):
+        for body in self.markdown:
+            match = _PROBABILITY.search(body)
+            if match:
+                return float(match.group(1)) / 100
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {'open': [], 'input': [], 'predict': [], 'reset': []}
+        self.predictions = 0
+        self.errors = []
+
+    def step(self, name, fn):
+        start = time.perf_counter()
+        error = None
+        try:
+            fn()
+        except Exception as e:      # ScriptError, timeouts, dropped connections
+            error = f"{type(e).__name__}: {e}"
+        with self._lock:
+            self.latencies[name].append(time.perf_counter() - start)
+            if error:
+                self.errors.append((name, error))
+        return error is None
+
+    def error(self, name, message):
+        with self._lock:
+            self.errors.append((name, message))
+
+
+def run_session(url, recorder, rng, think, timeout, deadline):
+    from websockets.sync.client import connect
+
+    while time.monotonic() < deadline:
+        try:
+            ws = connect(f"{url}/_stcore/stream", subprotocols=["streamlit"], max_size=None, open_timeout=timeout)
+        except Exception as e:
+            recorder.error('open', f"{type(e).__name__}: {e}")
+            time.sleep(1)
+            continue
+        with ws:
+            session = Session(ws, timeout)
+            if not recorder.step('open', session.run):
+                continue
+            time.sleep(rng.expovariate(1 / think))
+            session.set_inputs(sample_inputs(1, seed=rng.randrange(2**31))[0])
+            if not recorder.step('input', session.run):
+                continue
+            time.sleep(rng.expovariate(1 / think))
+            if not recorder.step('predict', lambda: session.run(["Predict Outcome"])):
+                continue
+            if session.probability() is None:
+                recorder.error('predict', "no probability shown")
+                continue
+            with recorder._lock:
+                recorder.predictions += 1
+            time.sleep(rng.expovariate(1 / think))
+            recorder.step('reset', lambda: session.run(["New Prediction"]))
+        time.sleep(rng.expovariate(1 / think))
+
+
+def process_usage(pid):
+    # -> (cpu seconds, rss bytes) of another process, from /proc
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    with open(f'/proc/{pid}/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return (int(fields[11]) + int(fields[12])) / _CLK_TCK, rss
+
+
+def run_level(url, pid, n_sessions, duration, think, timeout, seed):
+    recorder = Recorder()
+    cpu_start, rss_start = process_usage(pid) if pid else (None, None)
+    wall_start = time.perf_counter()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=run_session, daemon=True,
+                                args=(url, recorder, random.Random(seed * 1000 + i), think, timeout, deadline))
+               for i in range(n_sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    steps = sum(len(v) for v in recorder.latencies.values())
+    out = {
+        'sessions': n_sessions,
+        'seconds': round(wall, 1),
+        'predictions': recorder.predictions,
+        'throughput_per_s': recorder.predictions / wall,
+        'error_rate': len(recorder.errors) / steps if steps else 1.0,
+        'errors': sorted({e for _, e in recorder.errors})[:5],
+    }
+    if pid:
+        cpu_end, rss_end = process_usage(pid)
+        out.update(server_cpu_cores_busy=(cpu_end - cpu_start) / wall, server_rss_mb=rss_end / 2**20,
+                   server_rss_growth_mb=(rss_end - rss_start) / 2**20)
+    for name, values in recorder.latencies.items():
+        ms = np.array(values) * 1000
+        for q in (50, 90, 99):
+            out[f'{name}_p{q}_ms'] = float(np.percentile(ms, q)) if len(ms) else None
+    return out
+
+
+def saturation(levels):
+    for previous, level in zip(levels, levels[1:]):
+        if level['error_rate'] > 0.01 or level['throughput_per_s'] < previous['throughput_per_s'] * (1 + SATURATION_GAIN):
+            return previous['sessions']
+    return None
+
+
+def start_server(app_path, cores, timeout):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    cmd = [sys.executable, '-m', 'streamlit', 'run', os.path.basename(app_path),
+           '--server.address', '127.0.0.1', '--server.port', str(port), '--server.headless', 'true',
+           '--server.enableXsrfProtection', 'false', '--browser.gatherUsageStats', 'false']
+    cpus = sorted(os.sched_getaffinity(0))[:cores] if cores else None
+    server = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(app_path)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return server, f"ws://127.0.0.1:{port}", len(cpus) if cpus else len(os.sched_getaffinity(0))
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError(f"streamlit exited with code {server.returncode}")
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("streamlit did not become healthy in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default=APP_PATH)
+    parser.add_argument('--url', default=None, help="websocket base URL of a running server (default: start one)")
+    parser.add_argument('--pid', type=int, default=None, help="server PID for CPU/RSS figures when using --url")
+    parser.add_argument('--levels', default='1,2,4,8,16', help="concurrent sessions per step of the ramp")
+    parser.add_argument('--duration', type=float, default=60, help="seconds per level")
+    parser.add_argument('--think', type=float, default=2.0, help="mean think time between steps (s)")
+    parser.add_argument('--timeout', type=float, default=120, help="per script run (s)")
+    parser.add_argument('--cores', type=int, default=None, help="pin the started server to this many CPUs")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None)
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url, pid, cores = args.url.rstrip('/'), args.pid, args.cores or os.cpu_count()
+    else:
+        server, url, cores = start_server(args.app, args.cores, args.timeout)
+        pid = server.pid
+    try:
+        # One untimed session loads the model and fills the process-wide resources
+        warmup = Recorder()
+        run_session(url, warmup, random.Random(args.seed), 0.01, args.timeout, time.monotonic() + 0.1)
+        if warmup.errors:
+            parser.error(f"warm-up session failed: {warmup.errors[0][1]}")
+
+        levels = []
+        for n in (int(v) for v in args.levels.split(',')):
+            level = run_level(url, pid, n, args.duration, args.think, args.timeout, args.seed)
+            levels.append(level)
+            usage = (f"  server cpu={level['server_cpu_cores_busy']:.1f}/{cores} cores "
+                     f"rss={level['server_rss_mb']:.0f} MB (+{level['server_rss_growth_mb']:.0f})") if pid else ""
+            print(f"sessions={n:3d}  {level['throughput_per_s']:6.2f} pred/s  "
+                  f"predict p50={level['predict_p50_ms'] or 0:7.0f} ms p99={level['predict_p99_ms'] or 0:7.0f} ms  "
+                  f"errors={level['error_rate']:.1%}{usage}", flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {'cores': cores, 'think_s': args.think, 'levels': levels, 'saturation_sessions': saturation(levels)}
+    best = max(level['throughput_per_s'] for level in levels)
+    print(f"peak {best:.2f} pred/s ({best / cores:.2f} per core)"
+          + (f", saturates at ~{report['saturation_sessions']} sessions" if report['saturation_sessions'] else ""))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
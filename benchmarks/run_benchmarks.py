@@ -0,0 +1,160 @@
+"""Benchmark every stage of a prediction rerun (offline, CPU only).
+
+    python -m benchmarks.run_benchmarks                       # JSON to stdout
+    python -m benchmarks.run_benchmarks -o bench.json --save-baseline
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json --tolerance 0.2
+
+Run from the repository root (the app and model paths are relative). Each
+stage reports latency percentiles over --repeat calls plus the peak Python
+allocation of one traced call. With a baseline, stages whose p50 regressed
+by more than --tolerance are listed and the exit code is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from fit_cache import load_warm_model
+from predictor import MODEL_PATH, DEFAULT_INPUT, calculate_probs_ci, create_input_data, load_clf, sample_inputs
+
+BATCH_SIZES = (1, 8, 64, 256)
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    ms = np.array(times) * 1000
+    return {
+        'n': repeat,
+        'mean_ms': float(ms.mean()),
+        'min_ms': float(ms.min()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'peak_alloc_kb': peak / 1024,
+    }
+
+
+def app_rerun_stages(repeat):
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.abspath('app.py')
+    at = AppTest.from_file(app_path, default_timeout=600).run()
+    # First prediction waits for the background loader, so reruns measure steady state
+    at.sidebar.button[0].click().run()
+
+    nihss = iter(range(0, 43))
+
+    def first_page():
+        AppTest.from_file(app_path, default_timeout=600).run()
+
+    def rerun_cached():
+        at.run()
+
+    def rerun_new_prediction():
+        at.sidebar.number_input[1].set_value(next(nihss) % 43).run()
+
+    return {
+        'app_first_page': measure(first_page, max(1, repeat // 10)),
+        'app_rerun_cached': measure(rerun_cached, repeat),
+        'app_rerun_new_prediction': measure(rerun_new_prediction, min(repeat, 40)),
+    }
+
+
+def run(model_path, repeat, with_app):
+    results = {}
+    x = create_input_data(*DEFAULT_INPUT)
+
+    results['load_model'] = measure(lambda: load_warm_model(model_path), max(1, repeat // 10), warmup=0)
+    results['unpickle'] = measure(lambda: load_clf(model_path), max(1, repeat // 10), warmup=0)
+    clf = load_warm_model(model_path)
+
+    results['create_input_data'] = measure(lambda: create_input_data(*DEFAULT_INPUT), repeat * 10)
+    for n in BATCH_SIZES:
+        X = sample_inputs(n)
+        results[f'predict_proba_batch_{n}'] = measure(lambda: clf.predict_proba(X), repeat)
+    probs = clf.predict_proba(x)[0, 1]
+    results['calculate_probs_ci'] = measure(lambda: calculate_probs_ci(probs), repeat * 10)
+
+    from plot_overlay import composite, default_base, encode_png, render_png
+    base = default_base()
+    results['render_plot_uncached'] = measure(lambda: encode_png(composite(base, probs, probs - 0.05, probs + 0.05)), repeat)
+    results['render_plot_cached'] = measure(lambda: render_png(probs, probs - 0.05, probs + 0.05), repeat * 10)
+
+    if with_app:
+        results.update(app_rerun_stages(repeat))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for stage, stats in results.items():
+        base = baseline.get('stages', {}).get(stage)
+        if base and base['p50_ms'] > 0:
+            ratio = stats['p50_ms'] / base['p50_ms']
+            stats['vs_baseline'] = ratio
+            if ratio > 1 + tolerance:
+                regressions.append((stage, base['p50_ms'], stats['p50_ms'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--no-app', action='store_true', help="skip the AppTest rerun stages")
+    parser.add_argument('-o', '--output', default=None, help="write JSON here instead of stdout")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p50 slowdown (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    stages = run(args.model, args.repeat, not args.no_app)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': stages,
+    }
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(stages, json.load(f), args.tolerance)
+        report['regressions'] = [stage for stage, *_ in regressions]
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text + '\n')
+
+    for stage, base, now, ratio in regressions:
+        print(f"REGRESSION {stage}: p50 {base:.2f} ms -> {now:.2f} ms ({ratio:.2f}x)", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
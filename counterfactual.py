@@ -0,0 +1,67 @@
+"""Paired counterfactuals: every IVT choice x every occluded-vessel code.
+
+All variants of the current patient are stacked into one matrix and scored
+in a single predict_batch call. Results are cached per patient profile (the
+input without ivt_numeric and vessel_numeric), so flipping those widgets or
+reopening the panel costs nothing.
+"""
+import itertools
+
+import numpy as np
+
+from metrics import METRICS
+from prediction_cache import normalize_features
+from predictor import FEATURES, LABEL_CODES, EVT_THRESHOLD, predict_batch, to_prediction
+
+IVT_OPTIONS = LABEL_CODES['ivt_numeric']
+VESSEL_OPTIONS = LABEL_CODES['vessel_numeric']
+_IVT_COL = FEATURES.index('ivt_numeric')
+_VESSEL_COL = FEATURES.index('vessel_numeric')
+
+
+def variant_matrix(input_data):
+    variants = list(itertools.product(IVT_OPTIONS, VESSEL_OPTIONS))
+    X = np.repeat(np.asarray(input_data, dtype=float).reshape(1, -1), len(variants), axis=0)
+    X[:, _IVT_COL] = [IVT_OPTIONS[ivt] for ivt, _ in variants]
+    X[:, _VESSEL_COL] = [VESSEL_OPTIONS[vessel] for _, vessel in variants]
+    return variants, X
+
+
+def profile_key(input_data):
+    row = np.asarray(input_data, dtype=float).reshape(-1)
+    return 'counterfactual', normalize_features(np.delete(row, [_IVT_COL, _VESSEL_COL]))
+
+
+def score_variants(clf, input_data, threshold=EVT_THRESHOLD, score=None):
+    # -> [(ivt_label, vessel_label, Prediction)] in IVT x vessel order;
+    # score: X -> (probs, ci_lower, ci_upper), e.g. through the batcher
+    variants, X = variant_matrix(input_data)
+    with METRICS.timer('counterfactuals'):
+        probs, ci_lower, ci_upper = score(X) if score is not None else predict_batch(clf, X)
+    return [(ivt, vessel, to_prediction(*row, threshold=threshold))
+            for (ivt, vessel), row in zip(variants, zip(probs, ci_lower, ci_upper))]
+
+
+def cached_variants(cache, clf, input_data, threshold=EVT_THRESHOLD, score=None):
+    key = (cache.model_id, profile_key(input_data), threshold)
+    scored = cache.get(key)
+    if scored is None:
+        scored = score_variants(clf, input_data, threshold, score)
+        cache.put(key, scored)
+    return scored
+
+
+def counterfactual_table(scored, current_ivt, current_vessel):
+    """DataFrame of the variants; 'Flips' marks a recommendation different from the current input's."""
+    import pandas as pd
+
+    current = next(p for ivt, vessel, p in scored if ivt == current_ivt and vessel == current_vessel)
+    return pd.DataFrame([{
+        'IVT': ivt,
+        'Occluded Vessel': vessel,
+        'Probability': f"{p.probs:.1%}",
+        '95% CI': f"{p.ci_lower:.1%}–{p.ci_upper:.1%}",
+        'Recommendation': p.recommendation,
+        'Flips': "yes" if p.recommendation != current.recommendation else "",
+        'Current': "●" if (ivt, vessel) == (current_ivt, current_vessel) else "",
+    } for ivt, vessel, p in scored])
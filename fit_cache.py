@@ -0,0 +1,140 @@
+"""Precomputed TabPFN training context.
+
+TabPFN learns in context, so by default every predict_proba re-encodes the
+stored training set together with the query rows. warm_context() switches a
+fitted classifier to TabPFN's "fit_with_cache" engine: the training set is
+run through each ensemble member once and the attention key/value cache is
+kept, so later calls only pay for the query rows.
+
+The warmed classifier is also written to disk, versioned by the model file's
+content hash and the tabpfn/torch versions, so new worker processes load it
+instead of recomputing:
+
+    clf = load_warm_model('no_dominant_m2_24h_nihss_cpu.pkl')
+"""
+import hashlib
+import os
+from copy import deepcopy
+
+import joblib
+import numpy as np
+
+from predictor import MODEL_PATH, load_clf, model_digest
+
+# Bump when the on-disk layout changes
+CONTEXT_FORMAT = 1
+CACHE_DIR = os.environ.get('MDVO_CACHE_DIR', '.model_cache')
+
+
+def is_tabpfn(clf):
+    return hasattr(clf, 'executor_') and hasattr(clf, 'fit_mode')
+
+
+def _cached_model(clf):
+    model = deepcopy(clf.model_).to(clf.device_)
+    model.cache_trainset_representation = True
+    return model
+
+
+def _kv_engine_from_preprocessed(clf, executor):
+    # Same as InferenceEngineCacheKV.prepare, but reuses the already fitted preprocessing
+    import torch
+    from tabpfn.inference import InferenceEngineCacheKV
+
+    device = clf.device_
+    models = []
+    for X_train, y_train, cat_ix in zip(executor.X_trains, executor.y_trains, executor.cat_ixs):
+        model = _cached_model(clf)
+        X = torch.as_tensor(X_train, dtype=torch.float32, device=device).unsqueeze(1)
+        y = torch.as_tensor(y_train, dtype=torch.float32, device=device)
+        with torch.autocast(device.type, enabled=clf.use_autocast_), torch.inference_mode():
+            model.forward(None, X, y, only_return_standard_out=True,
+                          categorical_inds=[cat_ix], single_eval_pos=len(X))
+        models.append(model.cpu() if device.type != 'cpu' else model)
+
+    return InferenceEngineCacheKV(
+        preprocessors=list(executor.preprocessors),
+        ensemble_configs=list(executor.ensemble_configs),
+        cat_ixs=list(executor.cat_ixs),
+        n_train_samples=[len(y) for y in executor.y_trains],
+        models=models,
+        dtype_byte_size=executor.dtype_byte_size,
+        force_inference_dtype=executor.force_inference_dtype,
+        save_peak_mem=executor.save_peak_mem,
+    )
+
+
+def _kv_engine_from_raw(clf, executor):
+    from tabpfn.inference import InferenceEngineCacheKV
+
+    return InferenceEngineCacheKV.prepare(
+        executor.X_train, executor.y_train,
+        cat_ix=executor.cat_ix,
+        ensemble_configs=executor.ensemble_configs,
+        n_workers=executor.n_workers,
+        model=_cached_model(clf),
+        device=clf.device_,
+        rng=np.random.default_rng(executor.static_seed),
+        dtype_byte_size=executor.dtype_byte_size,
+        force_inference_dtype=executor.force_inference_dtype,
+        save_peak_mem=executor.save_peak_mem,
+        autocast=clf.use_autocast_,
+    )
+
+
+def warm_context(clf):
+    """Switch a fitted TabPFN classifier to a cached training context (in place)."""
+    if not is_tabpfn(clf) or clf.fit_mode == 'fit_with_cache':
+        return clf
+    executor = clf.executor_
+    if hasattr(executor, 'X_trains'):      # fit_preprocessors
+        clf.executor_ = _kv_engine_from_preprocessed(clf, executor)
+    elif hasattr(executor, 'X_train'):     # low_memory
+        clf.executor_ = _kv_engine_from_raw(clf, executor)
+    else:
+        return clf
+    clf.fit_mode = 'fit_with_cache'
+    return clf
+
+
+def context_version(model_path):
+    import tabpfn
+    import torch
+
+    key = f"{model_digest(model_path)}|{tabpfn.__version__}|{torch.__version__}|{CONTEXT_FORMAT}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def context_path(model_path, version, cache_dir=CACHE_DIR):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{name}.ctx-{version}.joblib")
+
+
+def load_warm_model(model_path=MODEL_PATH, cache_dir=CACHE_DIR):
+    """Load the model with a warmed context, from disk if a matching version exists."""
+    clf = None
+    path = None
+    try:
+        path = context_path(model_path, context_version(model_path), cache_dir)
+    except ImportError:
+        pass  # not a TabPFN deployment
+    if path and os.path.exists(path):
+        try:
+            clf = joblib.load(path)
+        except Exception:
+            clf = None  # unreadable/partial file - rebuild below
+    if clf is None:
+        clf = load_clf(model_path)
+        if is_tabpfn(clf):
+            warm_context(clf)
+            if path:
+                save_context(clf, path)
+    return clf
+
+
+def save_context(clf, path):
+    # Atomic write so concurrently starting workers never read a partial file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(clf, tmp)
+    os.replace(tmp, path)
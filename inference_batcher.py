@@ -0,0 +1,202 @@
+"""Micro-batching coordinator for concurrent sessions.
+
+Each Streamlit session submits its 1-row feature vector; a single worker
+thread collects pending requests for up to `max_wait_ms` or `max_batch`
+rows, scores them in one forward pass and hands each row back to its
+waiting session. submit_rows() queues a multi-row request (what-if sweeps,
+attribution walks) the same way, so all model work of a profile runs on
+its worker thread. The queue is bounded (submit raises queue.Full), and a
+request whose Future was cancelled before its batch starts is skipped.
+close() retires the worker after it has answered everything queued;
+requests submitted after that are scored inline by the caller.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, wait
+
+import numpy as np
+
+from inference_profiles import set_intra_op_threads
+from metrics import METRICS
+from predictor import FEATURES, predict_batch
+
+LATENCY_WINDOW = 4096
+MAX_ROWS_PER_REQUEST = 2048
+
+
+def _result(out, start, stop, single):
+    # Slice one request's rows out of a batch's (probs, ci_lower, ci_upper)
+    if single:
+        return tuple(float(v[start]) for v in out)
+    return tuple(np.asarray(v[start:stop]) for v in out)
+
+
+class InferenceBatcher:
+    def __init__(self, clf, max_wait_ms=5.0, max_batch=64, max_pending=256, threads=None):
+        self.clf = clf
+        self.threads = threads  # torch intra-op threads of the worker thread (None: the process's original count)
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._latencies = []
+        self.batch_sizes = Counter()
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_cancelled = 0
+        self._closed = False
+        self._busy = False
+        self._submit_lock = threading.Lock()
+        self._started = time.monotonic()
+        self._worker = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, input_data):
+        # input_data: (1, 16) or (16,) -> Future resolving to (probs, ci_lower, ci_upper) floats
+        return self._submit(np.asarray(input_data, dtype=float).reshape(1, -1), single=True)
+
+    def submit_rows(self, X):
+        # X: (n, 16) -> Future resolving to (probs, ci_lower, ci_upper) arrays of length n
+        return self._submit(np.asarray(X, dtype=float).reshape(-1, len(FEATURES)), single=False)
+
+    def _submit(self, rows, single):
+        future = Future()
+        with self._submit_lock:
+            if not self._closed:
+                self._queue.put_nowait((rows, future, time.perf_counter(), single))
+                return future
+        future.set_running_or_notify_cancel()
+        try:
+            out = predict_batch(self.clf, rows)
+            future.set_result(_result(out, 0, len(rows), single))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        # Everything queued before this point is still answered; later submits run inline
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+
+    def predict(self, input_data, timeout=None):
+        return self.submit(input_data).result(timeout)
+
+    def score_rows(self, X, timeout=None, on_wait=None, chunk_size=MAX_ROWS_PER_REQUEST):
+        """Score (n, 16) rows as queued requests and wait; -> (probs, ci_lower, ci_upper) arrays.
+
+        Large matrices go in chunks, so single-row requests of other sessions
+        are answered in between. on_wait(elapsed) is called every 0.1 s while
+        waiting (the app updates a status line there, which lets Streamlit stop
+        the run). Unfinished chunks are cancelled when the wait ends early;
+        raises TimeoutError after `timeout` seconds and queue.Full when the
+        queue has no room.
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, len(FEATURES))
+        futures = []
+        started = time.monotonic()
+        try:
+            for i in range(0, len(X), chunk_size):
+                futures.append(self.submit_rows(X[i:i + chunk_size]))
+            while not all(f.done() for f in futures):
+                elapsed = time.monotonic() - started
+                if timeout is not None and elapsed > timeout:
+                    raise TimeoutError(f"model call did not finish within {timeout:g} s")
+                if on_wait is not None:
+                    on_wait(elapsed)
+                wait(futures, timeout=0.1)
+        finally:
+            for future in futures:
+                future.cancel()     # no-op once running or done
+        parts = [f.result() for f in futures]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def idle(self):
+        # Nothing queued or being scored (background work may use the model now)
+        return self._queue.empty() and not self._busy
+
+    def _collect(self):
+        # -> (batch, closing); the None sentinel from close() ends the batch
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        n_rows = len(item[0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            n_rows += len(item[0])
+        return batch, False
+
+    def _run(self):
+        set_intra_op_threads(self.threads)
+        closing = False
+        while not closing:
+            batch, closing = self._collect()
+            # Drop requests cancelled while queued; the rest can no longer be cancelled
+            live = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if len(live) < len(batch):
+                with self._lock:
+                    self.n_cancelled += len(batch) - len(live)
+            if not live:
+                continue
+            batch = live
+            rows, futures, submitted, single = zip(*batch)
+            self._busy = True
+            try:
+                out = predict_batch(self.clf, np.vstack(rows))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._busy = False
+            done = time.perf_counter()
+            start = 0
+            for r, future, one in zip(rows, futures, single):
+                future.set_result(_result(out, start, start + len(r), one))
+                start += len(r)
+            latencies = [done - t for t in submitted]
+            self._record(start, latencies)
+            for latency in latencies:
+                METRICS.observe('batcher_request', latency)
+
+    def _record(self, batch_size, latencies):
+        # batch_size in rows; one latency per request
+        with self._lock:
+            self.n_requests += len(latencies)
+            self.n_batches += 1
+            self.batch_sizes[batch_size] += 1
+            self._latencies.extend(latencies)
+            del self._latencies[:-LATENCY_WINDOW]
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            elapsed = time.monotonic() - self._started
+            return {
+                'requests': self.n_requests,
+                'batches': self.n_batches,
+                'cancelled': self.n_cancelled,
+                'throughput_rps': self.n_requests / elapsed if elapsed else 0.0,
+                'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'batch_size_histogram': dict(sorted(self.batch_sizes.items())),
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch': self.max_batch,
+                'threads': self.threads,
+                'closed': self._closed,
+            }
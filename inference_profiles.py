@@ -0,0 +1,114 @@
+"""Named latency/accuracy profiles for serving the model.
+
+A profile sets how many ensemble members are evaluated, the torch intra-op
+thread count of its batcher's worker thread, and the batcher's batch size
+and wait. "full" is the model as trained; "fast" and "balanced" evaluate a
+prefix of the ensemble (TabPFN preprocessing configs, or trees of a
+forest), so they trade a small probability drift for latency. The app
+only shows them in the what-if curve; recommendations come from the
+deployment profile.
+
+    MDVO_PROFILE=balanced          # deployment default (headline predictions)
+    MDVO_WHATIF_PROFILE=fast       # app what-if views (default: MDVO_PROFILE)
+    python -m benchmarks.bench_profiles   # latency, CPU and drift vs "full"
+"""
+import copy
+import os
+import sys
+import threading
+from collections import namedtuple
+
+# ensemble_fraction: share of members evaluated (at least MIN_MEMBERS);
+# threads/max_batch/max_wait_ms: None keeps the process/deployment setting
+Profile = namedtuple('Profile', ['ensemble_fraction', 'threads', 'max_batch', 'max_wait_ms'])
+
+PROFILES = {
+    'fast': Profile(0.25, 1, 8, 1.0),
+    'balanced': Profile(0.5, 2, 32, 3.0),
+    'full': Profile(1.0, None, None, None),
+}
+# Fewer members drift too far from the full model's probability
+MIN_MEMBERS = 4
+DEFAULT_PROFILE = os.environ.get('MDVO_PROFILE', 'full')
+WHATIF_PROFILE = os.environ.get('MDVO_WHATIF_PROFILE', DEFAULT_PROFILE)
+
+_process_threads = None         # torch's thread count before any profile changed it
+_process_threads_lock = threading.Lock()
+
+
+def get_profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"unknown inference profile {name!r} (expected one of {', '.join(PROFILES)})")
+
+
+def subset_ensemble(clf, fraction):
+    """Shallow copy of `clf` evaluating only its first members; `clf` itself when not applicable."""
+    if fraction >= 1:
+        return clf
+    if hasattr(clf, 'executor_') and hasattr(clf.executor_, 'ensemble_configs'):
+        n = len(clf.executor_.ensemble_configs)
+        k = max(MIN_MEMBERS, round(n * fraction))
+        if k >= n:
+            return clf
+        # Every per-member list of the inference engine (configs, preprocessors, cached models, ...)
+        executor = copy.copy(clf.executor_)
+        for name, value in vars(clf.executor_).items():
+            if isinstance(value, list) and len(value) == n:
+                setattr(executor, name, value[:k])
+        est = copy.copy(clf)
+        est.executor_ = executor
+        est.n_estimators = k
+        return est
+    if hasattr(clf, 'estimators_'):
+        n = len(clf.estimators_)
+        k = max(MIN_MEMBERS, round(n * fraction))
+        if k >= n:
+            return clf
+        est = copy.copy(clf)
+        est.estimators_ = clf.estimators_[:k]
+        if getattr(clf, 'estimators_features_', None) is not None:
+            est.estimators_features_ = clf.estimators_features_[:k]
+        est.n_estimators = k
+        return est
+    return clf
+
+
+def set_intra_op_threads(n):
+    """Give the calling worker thread an explicit torch intra-op thread count, once.
+
+    torch.set_num_threads also changes the process-wide default that other
+    threads pick up on their first parallel op (and MKL's count is global),
+    so every model worker sets its count explicitly: the profile's, or for
+    None the count the process had before any profile changed it.
+    """
+    global _process_threads
+    torch = sys.modules.get('torch')
+    if torch is None:
+        return
+    with _process_threads_lock:
+        if _process_threads is None:
+            _process_threads = torch.get_num_threads()
+    torch.set_num_threads(n or _process_threads)
+
+
+class ProfiledModel:
+    """The loaded model under one profile: its member subset and batcher."""
+
+    def __init__(self, clf, name=DEFAULT_PROFILE, max_pending=256):
+        from inference_batcher import InferenceBatcher
+
+        self.name = name
+        self.profile = get_profile(name)
+        self.clf = subset_ensemble(clf, self.profile.ensemble_fraction)
+        max_wait_ms = self.profile.max_wait_ms
+        if max_wait_ms is None:
+            max_wait_ms = float(os.environ.get('MDVO_BATCH_WAIT_MS', 5))
+        self.batcher = InferenceBatcher(self.clf, max_wait_ms=max_wait_ms,
+                                        max_batch=self.profile.max_batch or int(os.environ.get('MDVO_MAX_BATCH', 64)),
+                                        max_pending=max_pending, threads=self.profile.threads)
+
+    def predict_batch(self, input_data):
+        # Through the batcher, so the profile's thread count applies
+        return self.batcher.score_rows(input_data)
@@ -0,0 +1,305 @@
+"""Precomputed prediction table over the (mostly discrete) input space.
+
+The grid is the full product of the categorical codes, NIHSS 0-42 and
+prestroke mRS 0-6, crossed with knots for each wide continuous input (age,
+onset to imaging, glucose, tissue at risk). Each cell stores the
+probability as a uint16 fraction in a memory-mapped .npy; the knots, model
+hash and fill progress live in a JSON index next to it. The CI bounds are
+recomputed from the (interpolated) probability with
+predictor.calculate_probs_ci, as on every other path.
+
+At serve time a row is answered by exact match - a few array gathers,
+microseconds per row. The default grid has one knot per continuous input
+(the sidebar defaults): 924,672 cells, 1.8 MB, buildable in one sitting.
+A grid with more knots can also answer rows between them by multilinear
+interpolation, but only once `calibrate` has stored a decision margin
+(99th percentile of the interpolated ci_lower error): interpolated rows
+whose ci_lower is within that margin of the EVT threshold are misses, as
+in surrogate.py. Rows off the grid, near the threshold, or touching a cell
+that is not filled yet go to the live model.
+
+    python lookup_table.py build     [--model ...] [--workers 8] [--knots age=18,50,70,85,100 ...] [--dry-run]
+    python lookup_table.py report    [--model ...] [--samples 2000]    # interpolation error vs live model
+    python lookup_table.py calibrate [--model ...] [--samples 4000]    # store the margin, enable interpolation
+
+The build is chunked, parallel and resumable: rerunning it fills only the
+chunks that are still missing.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fit_cache import CACHE_DIR
+from metrics import METRICS
+from predictor import (MODEL_PATH, FEATURES, NUMERIC_RANGES, CATEGORICAL_CODES, EVT_THRESHOLD, DECISION_CI,
+                       DEFAULT_INPUT, calculate_probs_ci, model_digest, predict_batch, sample_inputs)
+
+TABLE_FORMAT = 2
+INTERPOLATED = ('age', 'onset_to_img', 'glucose', 'tissue_at_risk')
+DEFAULT_KNOTS = dict(
+    CATEGORICAL_CODES,
+    nihss=tuple(range(43)),
+    prestroke_mrs=tuple(range(7)),
+    # Exact hits only by default; see the module docstring for finer grids
+    **{f: (DEFAULT_INPUT[FEATURES.index(f)],) for f in INTERPOLATED},
+)
+MISSING = np.iinfo(np.uint16).max
+SCALE = MISSING - 1
+
+
+def table_path(model_path=MODEL_PATH, cache_dir=CACHE_DIR):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.environ.get('MDVO_LOOKUP_TABLE') or os.path.join(cache_dir, f"{name}.table")
+
+
+class LookupTable:
+    def __init__(self, values, index):
+        self.values = values                                  # (n_cells,) uint16 probs, C order over FEATURES
+        self.index = index
+        self.knots = [np.asarray(index['knots'][f], dtype=float) for f in FEATURES]
+        self.shape = tuple(len(k) for k in self.knots)
+        self.strides = np.array([int(np.prod(self.shape[i + 1:])) for i in range(len(FEATURES))])
+        # A feature with a single knot is matched exactly
+        self.interp_cols = [FEATURES.index(f) for f in INTERPOLATED if len(index['knots'][f]) > 1]
+        self.exact_cols = [i for i in range(len(FEATURES)) if i not in self.interp_cols]
+        self.corners = np.array(list(itertools.product((0, 1), repeat=len(self.interp_cols))))
+
+    def cells_to_inputs(self, start, stop):
+        idx = np.unravel_index(np.arange(start, stop), self.shape)
+        return np.column_stack([k[i] for k, i in zip(self.knots, idx)])
+
+    @property
+    def decision_margin(self):
+        # None until `calibrate` has run: interpolated rows are then always misses
+        return self.index.get('decision_margin')
+
+    def interpolate(self, X):
+        """-> (probs, ci_lower, ci_upper, covered, exact) without the decision margin.
+
+        covered: the row is on the grid and every cell it needs is filled;
+        exact: it sits on knots in every dimension (no interpolation).
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, len(FEATURES))
+        n = len(X)
+        hit = np.ones(n, dtype=bool)
+        base = np.zeros(n, dtype=np.int64)
+        for col in self.exact_cols:
+            knots = self.knots[col]
+            i = np.clip(np.searchsorted(knots, X[:, col]), 0, len(knots) - 1)
+            hit &= np.isclose(knots[i], X[:, col])
+            base += i * self.strides[col]
+        frac = np.zeros((n, len(self.interp_cols)))
+        for j, col in enumerate(self.interp_cols):
+            knots = self.knots[col]
+            hit &= (X[:, col] >= knots[0]) & (X[:, col] <= knots[-1])
+            i = np.clip(np.searchsorted(knots, X[:, col], side='right') - 1, 0, len(knots) - 2)
+            frac[:, j] = np.clip((X[:, col] - knots[i]) / (knots[i + 1] - knots[i]), 0, 1)
+            base += i * self.strides[col]
+        # 2^k surrounding cells and their multilinear weights
+        offsets = self.corners @ self.strides[self.interp_cols]
+        weights = np.prod(np.where(self.corners[None], frac[:, None], 1 - frac[:, None]), axis=2)
+        cells = self.values[(base[:, None] + offsets[None]).clip(0, len(self.values) - 1)]   # (n, corners)
+        needed = weights > 0
+        hit &= ~np.any((cells == MISSING) & needed, axis=1)
+        exact = needed.sum(axis=1) == 1
+        probs = np.einsum('nc,nc->n', weights, cells.astype(float) / SCALE)
+        ci_lower, ci_upper = calculate_probs_ci(probs)
+        return probs, ci_lower, ci_upper, hit, exact
+
+    def lookup(self, X, threshold=EVT_THRESHOLD):
+        """-> (probs, ci_lower, ci_upper, hit); rows with hit=False must go to the live model."""
+        probs, ci_lower, ci_upper, hit, exact = self.interpolate(X)
+        if self.decision_margin is None:
+            hit &= exact
+        else:
+            hit &= exact | (np.abs(ci_lower - threshold) >= self.decision_margin)
+        return probs, ci_lower, ci_upper, hit
+
+    def lookup_one(self, input_data, threshold=EVT_THRESHOLD):
+        # -> (probs, ci_lower, ci_upper) or None on a miss
+        with METRICS.timer('lookup_table'):
+            probs, ci_lower, ci_upper, hit = self.lookup(input_data, threshold)
+        return (probs[0], ci_lower[0], ci_upper[0]) if hit[0] else None
+
+
+def load_table(model_path=MODEL_PATH, path=None, digest=None):
+    """Memory-mapped table for this model file, or None (missing, stale or other format)."""
+    path = path or table_path(model_path)
+    if not (os.path.exists(path + '.npy') and os.path.exists(path + '.json')):
+        return None
+    with open(path + '.json') as f:
+        index = json.load(f)
+    if index.get('format') != TABLE_FORMAT or index['model_digest'] != (digest or model_digest(model_path)):
+        return None
+    if index.get('decision_ci') != DECISION_CI:
+        return None
+    return LookupTable(np.load(path + '.npy', mmap_mode='r'), index)
+
+
+def _write_index(path, index):
+    tmp = f"{path}.json.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, path + '.json')
+
+
+# Build workers: model loaded once per process by the pool initializer
+_build_state = {}
+
+
+def _init_build_worker(model_path, path, index):
+    from fit_cache import load_warm_model
+
+    clf = load_warm_model(model_path)
+    values = np.load(path + '.npy', mmap_mode='r+')
+    _build_state.update(clf=clf, table=LookupTable(values, index))
+
+
+def _fill_chunk(bounds):
+    start, stop = bounds
+    table = _build_state['table']
+    X = table.cells_to_inputs(start, stop)
+    probs = predict_batch(_build_state['clf'], X)[0]
+    table.values[start:stop] = np.round(np.clip(probs, 0, 1) * SCALE)
+    table.values.flush()
+    return start
+
+
+def build(model_path, path, knots, workers=None, chunk_size=4096):
+    index = {'format': TABLE_FORMAT, 'knots': {f: [float(v) for v in knots[f]] for f in FEATURES},
+             'model_digest': model_digest(model_path), 'decision_ci': DECISION_CI, 'chunk_size': chunk_size,
+             'done': []}
+    n_cells = int(np.prod([len(knots[f]) for f in FEATURES]))
+    if os.path.exists(path + '.json'):
+        with open(path + '.json') as f:
+            previous = json.load(f)
+        keys = ('format', 'knots', 'model_digest', 'decision_ci', 'chunk_size')
+        if {k: previous.get(k) for k in keys} == {k: index[k] for k in keys}:
+            index = previous                                  # resume
+    if not index['done'] or not os.path.exists(path + '.npy'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        values = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=np.uint16, shape=(n_cells,))
+        values[:] = MISSING
+        values.flush()
+        del values
+        index['done'] = []
+    _write_index(path, index)
+
+    done = set(index['done'])
+    todo = [(s, min(s + chunk_size, n_cells)) for s in range(0, n_cells, chunk_size) if s not in done]
+    if not todo:
+        print("table complete")
+        return n_cells
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_build_worker, initargs=(model_path, path, index)) as pool:
+        for i, chunk_start in enumerate(pool.map(_fill_chunk, todo), 1):
+            index['done'].append(chunk_start)
+            if i % 16 == 0 or i == len(todo):
+                _write_index(path, index)
+                rate = i * chunk_size / (time.perf_counter() - start)
+                print(f"{i}/{len(todo)} chunks, {rate:,.0f} cells/s", flush=True)
+    return n_cells
+
+
+def _grid_sample(table, n_samples, seed):
+    X = sample_inputs(n_samples, seed=seed)
+    # Snap the exact dimensions onto the grid, so the sample measures interpolation
+    for col in table.exact_cols:
+        knots = table.knots[col]
+        X[:, col] = knots[np.random.default_rng(seed + col).integers(0, len(knots), len(X))]
+    return X
+
+
+def calibrate_margin(table, clf, n_samples, seed=0):
+    """99th percentile of |ci_lower error| over interpolated rows (0.0 for an exact-only grid)."""
+    X = _grid_sample(table, n_samples, seed)
+    _, ci_lower, _, covered, exact = table.interpolate(X)
+    rows = covered & ~exact
+    if not rows.any():
+        return 0.0
+    live = predict_batch(clf, X[rows])[1]
+    return float(np.quantile(np.abs(ci_lower[rows] - live), 0.99))
+
+
+def report(table, clf, n_samples, seed=0, threshold=EVT_THRESHOLD):
+    # Error of every covered row; hit rate and agreement as served, with the stored margin
+    X = _grid_sample(table, n_samples, seed)
+    start = time.perf_counter()
+    probs, ci_lower, ci_upper, hit = table.lookup(X, threshold)
+    lookup_us = (time.perf_counter() - start) / len(X) * 1e6
+    covered = table.interpolate(X)[3]
+    live = np.column_stack(predict_batch(clf, X[covered])) if covered.any() else np.empty((0, 3))
+    err = np.abs(np.column_stack([probs, ci_lower, ci_upper])[covered] - live)
+    served = hit[covered]
+    return {
+        'n': len(X),
+        'decision_margin': table.decision_margin,
+        'covered_rate': float(covered.mean()),
+        'hit_rate': float(hit.mean()),
+        'lookup_us_per_row': lookup_us,
+        'max_abs_error': dict(zip(('probs', 'ci_lower', 'ci_upper'), err.max(axis=0).round(5).tolist())) if len(err) else None,
+        'mean_abs_error': dict(zip(('probs', 'ci_lower', 'ci_upper'), err.mean(axis=0).round(5).tolist())) if len(err) else None,
+        'decision_agreement': float(np.mean((ci_lower[hit] > threshold) == (live[served, 1] > threshold))) if served.any() else None,
+    }
+
+
+def parse_knots(specs):
+    knots = dict(DEFAULT_KNOTS)
+    for spec in specs or []:
+        feature, _, values = spec.partition('=')
+        if feature not in FEATURES:
+            raise ValueError(f"unknown feature {feature!r}")
+        knots[feature] = tuple(sorted(float(v) for v in values.split(',')))
+    for feature in INTERPOLATED:
+        low, high, _ = NUMERIC_RANGES[feature]
+        if knots[feature][0] < low or knots[feature][-1] > high:
+            raise ValueError(f"{feature} knots outside the widget range {low}-{high}")
+    return knots
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute / check the prediction lookup table")
+    parser.add_argument('command', choices=['build', 'report', 'calibrate'])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--out', default=None, help="table path without extension (default: in .model_cache)")
+    parser.add_argument('--knots', nargs='*', metavar='FEATURE=V1,V2,...', help="override the grid of a feature")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--samples', type=int, default=None, help="rows sampled (report: 2000, calibrate: 4000)")
+    parser.add_argument('--dry-run', action='store_true', help="print the grid size and exit")
+    args = parser.parse_args()
+
+    path = args.out or table_path(args.model)
+    if args.command == 'build':
+        try:
+            knots = parse_knots(args.knots)
+        except ValueError as e:
+            parser.error(str(e))
+        n_cells = int(np.prod([len(knots[f]) for f in FEATURES]))
+        print(f"{n_cells:,} cells, {n_cells * 6 / 2**20:,.1f} MB")
+        if not args.dry_run:
+            build(args.model, path, knots, args.workers, args.chunk_size)
+        return
+
+    from fit_cache import load_warm_model
+
+    table = load_table(args.model, path)
+    if table is None:
+        parser.error(f"no table for {args.model} at {path} (run 'build' first)")
+    clf = load_warm_model(args.model)
+    if args.command == 'calibrate':
+        # Calibrate and report on different samples
+        margin = calibrate_margin(table, clf, args.samples or 4000, seed=1)
+        table.index['decision_margin'] = margin
+        _write_index(path, table.index)
+        print(f"decision margin {margin:.4f} stored in {path}.json")
+    print(json.dumps(report(table, clf, args.samples or 2000), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Memory budget for Streamlit sessions, instead of a gc.collect() per rerun.
+
+Each session's state is sized after every script run (approximate deep
+size). Over the per-session budget, the session's evictable entries - derived
+values the app can recompute, e.g. the encoded result image - are dropped,
+largest first. A full collection only runs when process RSS is above its
+limit, and then also clears the registered process-wide caches. Pause
+times and reclaimed bytes go to METRICS (memory_collect, memory_reclaimed_bytes).
+
+    MDVO_SESSION_BUDGET_KB=1024    MDVO_RSS_LIMIT_MB=4096   # default: 80% of RAM
+"""
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from metrics import METRICS, process_rss_bytes
+
+logger = logging.getLogger('mdvo.memory')
+
+SESSION_BUDGET_KB = float(os.environ.get('MDVO_SESSION_BUDGET_KB', 1024))
+# At most one collection per interval, so a heap that stays large does not collect on every rerun
+MIN_COLLECT_INTERVAL = 10.0
+SESSION_TTL = 3600.0
+
+
+def default_rss_limit():
+    if os.environ.get('MDVO_RSS_LIMIT_MB'):
+        return float(os.environ['MDVO_RSS_LIMIT_MB']) * 2**20
+    try:
+        return 0.8 * os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_bytes(obj, _depth=0):
+    # Deep size of plain containers and arrays; other objects count shallow
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    size = sys.getsizeof(obj)
+    if _depth > 4:
+        return size
+    if isinstance(obj, dict):
+        size += sum(estimate_bytes(k, _depth + 1) + estimate_bytes(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_bytes(v, _depth + 1) for v in obj)
+    return size
+
+
+class MemoryManager:
+    def __init__(self, session_budget_kb=SESSION_BUDGET_KB, rss_limit=None):
+        self.session_budget = session_budget_kb * 1024
+        self.rss_limit = rss_limit if rss_limit is not None else default_rss_limit()
+        self._lock = threading.Lock()
+        self._sessions = {}       # session id -> (bytes, last seen)
+        self._reclaimers = []
+        self._caches = weakref.WeakSet()
+        self._last_collect = 0.0
+        self.n_collections = 0
+        self.n_evictions = 0
+        self.reclaimed_bytes = 0
+        self.last_pause = None
+        METRICS.register_collector(self.gauges)
+
+    def register_reclaimer(self, fn):
+        # fn() drops a process-wide cache that can be rebuilt (e.g. lru_cache.cache_clear)
+        self._reclaimers.append(fn)
+
+    def register_cache(self, cache):
+        # Like register_reclaimer(cache.clear), but held weakly: per-model caches come and go
+        self._caches.add(cache)
+
+    def track(self, session_id, state, evictable=()):
+        """Size `state` (a dict-like session state); evict over budget, collect over the RSS limit."""
+        sizes = {key: estimate_bytes(state[key]) for key in list(state.keys())}
+        total = sum(sizes.values())
+        if total > self.session_budget:
+            for key in sorted((k for k in evictable if k in sizes), key=sizes.get, reverse=True):
+                del state[key]
+                total -= sizes[key]
+                self.n_evictions += 1
+                METRICS.inc('memory_session_evictions')
+                if total <= self.session_budget:
+                    break
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (total, now)
+            for sid in [s for s, (_, seen) in self._sessions.items() if now - seen > SESSION_TTL]:
+                del self._sessions[sid]
+        self.maybe_collect()
+        return total
+
+    def maybe_collect(self):
+        if self.rss_limit is None or process_rss_bytes() <= self.rss_limit:
+            return None
+        with self._lock:
+            if time.monotonic() - self._last_collect < MIN_COLLECT_INTERVAL:
+                return None
+            self._last_collect = time.monotonic()
+        return self.collect()
+
+    def collect(self):
+        """Clear the registered caches and run a full collection; -> (reclaimed bytes, pause seconds)."""
+        before = process_rss_bytes()
+        start = time.perf_counter()
+        for fn in self._reclaimers + [cache.clear for cache in list(self._caches)]:
+            try:
+                fn()
+            except Exception:
+                logger.exception("memory reclaimer failed")
+        objects = gc.collect()
+        pause = time.perf_counter() - start
+        reclaimed = max(0, before - process_rss_bytes())
+        with self._lock:
+            self.n_collections += 1
+            self.reclaimed_bytes += reclaimed
+            self.last_pause = pause
+        METRICS.observe('memory_collect', pause)
+        METRICS.inc('memory_collections')
+        METRICS.inc('memory_reclaimed_bytes', reclaimed)
+        logger.info("RSS above %.0f MB: collected %d objects in %.1f ms, reclaimed %.1f MB",
+                    self.rss_limit / 2**20, objects, pause * 1000, reclaimed / 2**20)
+        return reclaimed, pause
+
+    def stats(self):
+        with self._lock:
+            sizes = [size for size, _ in self._sessions.values()]
+            return {
+                'sessions': len(sizes),
+                'session_bytes_total': sum(sizes),
+                'session_bytes_max': max(sizes, default=0),
+                'session_budget_bytes': self.session_budget,
+                'rss_limit_bytes': self.rss_limit,
+                'collections': self.n_collections,
+                'evictions': self.n_evictions,
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'last_pause_ms': self.last_pause * 1000 if self.last_pause is not None else None,
+            }
+
+    def gauges(self):
+        # The event totals are METRICS counters already
+        stats = self.stats()
+        return {f'memory_{k}': stats[k] for k in ('sessions', 'session_bytes_total', 'session_bytes_max',
+                                                   'session_budget_bytes', 'rss_limit_bytes') if stats[k] is not None}
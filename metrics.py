@@ -0,0 +1,181 @@
+"""Low-overhead, process-wide instrumentation.
+
+Per-stage latency histograms, counters and process memory, exposed in the
+Prometheus text format. Recording is a perf_counter pair plus a bisect
+under a lock (about a microsecond), so it stays on in production.
+
+    MDVO_METRICS_PORT=9464           serve http://127.0.0.1:9464/metrics
+    MDVO_METRICS_LOG_INTERVAL=60     log a one-line summary every 60 s
+"""
+import bisect
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('mdvo.metrics')
+
+# Seconds; covers cache hits (~µs) up to cold TabPFN passes
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = 'mdvo'
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # Not Linux: peak RSS is the best available (KB on Linux/BSD, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+
+    def quantile(self, q):
+        # Upper bucket bound containing the q-quantile (Prometheus-style estimate)
+        if not self.n:
+            return None
+        target = q * self.n
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.stage_rss = {}
+        self._collectors = []
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, track_memory=False):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+            if track_memory:
+                self.record_memory(stage)
+
+    def record_memory(self, stage):
+        # RSS right after the stage; one /proc read, so only for the coarse stages
+        rss = process_rss_bytes()
+        with self._lock:
+            self.stage_rss[stage] = rss
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register_collector(self, fn):
+        # fn() -> {name: value}, sampled at export time (e.g. cache stats)
+        with self._lock:
+            self._collectors.append(fn)
+
+    def unregister_collector(self, fn):
+        with self._lock:
+            if fn in self._collectors:
+                self._collectors.remove(fn)
+
+    def gauges(self):
+        values = {'process_rss_bytes': process_rss_bytes()}
+        for fn in list(self._collectors):
+            try:
+                values.update(fn())
+            except Exception:
+                logger.exception("metrics collector failed")
+        return values
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = {k: (list(h.counts), h.total, h.n) for k, h in self.histograms.items()}
+            counters = dict(self.counters)
+            stage_rss = dict(self.stage_rss)
+        name = f'{PREFIX}_stage_latency_seconds'
+        lines += [f'# HELP {name} Latency per hot-path stage.', f'# TYPE {name} histogram']
+        for stage, (counts, total, n) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {n}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {n}')
+        for counter, value in sorted(counters.items()):
+            lines += [f'# TYPE {PREFIX}_{counter}_total counter', f'{PREFIX}_{counter}_total {value}']
+        for gauge, value in sorted(self.gauges().items()):
+            lines += [f'# TYPE {PREFIX}_{gauge} gauge', f'{PREFIX}_{gauge} {value}']
+        if stage_rss:
+            lines.append(f'# TYPE {PREFIX}_stage_rss_bytes gauge')
+            lines += [f'{PREFIX}_stage_rss_bytes{{stage="{s}"}} {v}' for s, v in sorted(stage_rss.items())]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        with self._lock:
+            parts = [f"{stage}: n={h.n} p50<={h.quantile(0.5)}s p99<={h.quantile(0.99)}s"
+                     for stage, h in sorted(self.histograms.items())]
+            parts += [f"{name}={value}" for name, value in sorted(self.counters.items())]
+        parts.append(f"rss={process_rss_bytes() / 2**20:.0f}MB")
+        return ' | '.join(parts)
+
+
+METRICS = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(port=None, log_interval=None, host='127.0.0.1'):
+    """Start the /metrics endpoint and/or the periodic log line (from env by default)."""
+    port = port if port is not None else int(os.environ.get('MDVO_METRICS_PORT', 0))
+    log_interval = log_interval if log_interval is not None else float(os.environ.get('MDVO_METRICS_LOG_INTERVAL', 0))
+    server = None
+    if port:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    if log_interval:
+        def log_loop():
+            while True:
+                time.sleep(log_interval)
+                logger.info("metrics %s", METRICS.summary())
+        threading.Thread(target=log_loop, name='metrics-log', daemon=True).start()
+    return server
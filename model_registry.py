@@ -0,0 +1,154 @@
+"""Registry of outcome models served side by side.
+
+Every `*.pkl` in the model directory is a model; an optional sidecar JSON
+with the same stem describes it:
+
+    {"label": "24h NIHSS 0-2, non-dominant M2", "threshold": 0.23,
+     "features": ["age", "sex_numeric", ...]}
+
+`features` must match the app's input order (predictor.FEATURES); models
+that expect another order are skipped with a warning. Models are loaded
+lazily (ModelLoader, in the background) on first use and the least recently
+used ones are unloaded once the loaded models exceed the memory cap.
+
+When a model file is replaced, the new version loads in the background
+while the old one keeps serving; the swap happens once it is ready. An
+unloaded model's batcher still answers everything already queued, and
+sessions holding the old loader keep a working model until they let go.
+
+    MDVO_MODEL_DIR=models/  MDVO_MODEL_MEMORY_MB=4096
+"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from predictor import MODEL_PATH, FEATURES, EVT_THRESHOLD, model_identity
+from startup import ModelLoader
+
+logger = logging.getLogger('mdvo.registry')
+
+MODEL_DIR = os.environ.get('MDVO_MODEL_DIR', '.')
+MEMORY_CAP_MB = float(os.environ.get('MDVO_MODEL_MEMORY_MB', 4096))
+
+ModelInfo = namedtuple('ModelInfo', ['name', 'path', 'label', 'threshold', 'metadata'])
+
+
+def read_model_info(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    metadata = {}
+    sidecar = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            metadata = json.load(f)
+    features = metadata.get('features', FEATURES)
+    if list(features) != FEATURES:
+        raise ValueError(f"{name}: feature order {features} differs from the app's {FEATURES}")
+    if 'ci_method' in metadata:
+        # Every model is served with the Wald interval (predictor.calculate_probs_ci)
+        logger.warning("%s: ignoring ci_method %r in the sidecar", name, metadata['ci_method'])
+    return ModelInfo(name, path, metadata.get('label', name), float(metadata.get('threshold', EVT_THRESHOLD)),
+                     metadata)
+
+
+def discover(directory=MODEL_DIR):
+    models = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.pkl'):
+            try:
+                info = read_model_info(os.path.join(directory, filename))
+            except (ValueError, OSError) as e:
+                logger.warning("skipping model: %s", e)
+                continue
+            models[info.name] = info
+    return models
+
+
+class _Slot:
+    def __init__(self, identity, loader):
+        self.identity = identity
+        self.loader = loader
+        self.next = None    # (identity, loader) while a replaced file is loading
+
+
+class ModelRegistry:
+    def __init__(self, directory=MODEL_DIR, memory_cap_mb=MEMORY_CAP_MB, default_path=MODEL_PATH):
+        self.directory = directory
+        self.memory_cap = memory_cap_mb * 2**20
+        self.models = discover(directory)
+        self._slots = OrderedDict()     # name -> _Slot, least recently used first
+        self._lock = threading.Lock()
+        default = os.path.splitext(os.path.basename(default_path))[0]
+        if not self.models:
+            # Nothing discovered: keep the configured model, so its load error is what gets reported
+            self.models[default] = ModelInfo(default, default_path, default, EVT_THRESHOLD, {})
+        self.default = default if default in self.models else next(iter(self.models))
+
+    def names(self):
+        return list(self.models)
+
+    def info(self, name=None):
+        return self.models[name or self.default]
+
+    def get(self, name=None):
+        """The ModelLoader for `name` (default model if None); starts loading on first use."""
+        info = self.info(name)
+        try:
+            identity = model_identity(info.path)
+        except OSError:
+            identity = None
+        with self._lock:
+            slot = self._slots.get(info.name)
+            if slot is None:
+                slot = self._slots[info.name] = _Slot(identity, ModelLoader(info.path))
+                logger.info("loading model %s", info.name)
+            elif identity is not None and identity != slot.identity:
+                self._swap(info, slot, identity)
+            self._slots.move_to_end(info.name)
+            self._evict(keep=info.name)
+            return slot.loader
+
+    def _swap(self, info, slot, identity):
+        # The old version serves until the new one is ready
+        if slot.next is None or slot.next[0] != identity:
+            logger.info("model %s changed on disk, loading the new version", info.name)
+            slot.next = (identity, ModelLoader(info.path))
+            return
+        loader = slot.next[1]
+        if not loader.ready:
+            return
+        if loader.error is not None:
+            logger.error("new version of %s failed to load, keeping the old one: %s", info.name, loader.error)
+            slot.identity = identity  # do not retry until the file changes again
+        else:
+            self._retire(slot.loader)
+            slot.identity, slot.loader = identity, loader
+            logger.info("model %s swapped to the new version", info.name)
+        slot.next = None
+
+    def _evict(self, keep):
+        # Only fully loaded models count towards (and are evicted under) the cap
+        loaded = [(name, slot) for name, slot in self._slots.items() if slot.loader.ready]
+        total = sum(slot.loader.memory_bytes for _, slot in loaded)
+        for name, slot in loaded:
+            if total <= self.memory_cap:
+                break
+            if name == keep or slot.next is not None:
+                continue
+            logger.info("unloading model %s (%.0f MB) to stay under the memory cap", name, slot.loader.memory_bytes / 2**20)
+            total -= slot.loader.memory_bytes
+            self._retire(slot.loader)
+            del self._slots[name]
+
+    @staticmethod
+    def _retire(loader):
+        if loader.ready:
+            loader.close()
+
+    def stats(self):
+        with self._lock:
+            loaded = {name: {'ready': slot.loader.ready, 'memory_mb': slot.loader.memory_bytes / 2**20,
+                             'swapping': slot.next is not None}
+                      for name, slot in self._slots.items()}
+        return {'models': self.names(), 'loaded': loaded, 'memory_cap_mb': self.memory_cap / 2**20}
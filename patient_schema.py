@@ -0,0 +1,224 @@
+"""Typed patient-record schema for bulk scoring.
+
+One schema object for the 16 model inputs: storage dtype, allowed range and
+categorical codes (from predictor's NUMERIC_RANGES / CATEGORICAL_CODES) and
+the labels the sidebar shows (LABEL_CODES). Cohorts are held as a NumPy
+structured array of RECORD_DTYPE (31 bytes per patient instead of 128 for
+the float matrix). Label encoding, validation and conversion to the model's
+(n, 16) float matrix work column by column on whole arrays - no per-row Python.
+
+    X = encode_columns({'age': [72, 80], 'sex_numeric': ['Male', 'Female'], ...})
+    report = validate(X)                  # bad cells per column: rows and values
+    records = to_records(X[report.valid])
+    probs, ci_lower, ci_upper = predict_batch(clf, to_matrix(records))
+
+    python patient_schema.py cohort.csv   # validate a cohort file, exit 1 on bad cells
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib import recfunctions
+
+from predictor import FEATURES, NUMERIC_RANGES, CATEGORICAL_CODES, LABEL_CODES
+
+# Integer fields must be whole numbers; the two float fields keep full precision
+# so a record converts back to exactly the value that was scored
+DTYPES = {'age': np.uint8, 'onset_to_img': np.uint16, 'glucose': np.float64, 'tissue_at_risk': np.float64}
+MAX_REPORTED_ROWS = 5
+
+Field = namedtuple('Field', ['name', 'dtype', 'low', 'high', 'codes', 'labels'])
+
+
+def build_schema():
+    fields = []
+    for feature in FEATURES:
+        dtype = np.dtype(DTYPES.get(feature, np.uint8))
+        if feature in NUMERIC_RANGES:
+            low, high, _ = NUMERIC_RANGES[feature]
+            codes = None
+        else:
+            codes = np.array(CATEGORICAL_CODES[feature], dtype=float)
+            low, high = codes.min(), codes.max()
+        if dtype.kind == 'u' and high > np.iinfo(dtype).max:
+            raise ValueError(f"{feature}: range up to {high} does not fit {dtype}")
+        fields.append(Field(feature, dtype, low, high, codes, LABEL_CODES.get(feature, {})))
+    return tuple(fields)
+
+
+SCHEMA = build_schema()
+FIELDS = {f.name: f for f in SCHEMA}
+RECORD_DTYPE = np.dtype([(f.name, f.dtype) for f in SCHEMA])
+
+
+class ValidationReport(namedtuple('ValidationReport', ['n_rows', 'bad_cells', 'bad_rows', 'bad_values', 'valid'])):
+    @property
+    def ok(self):
+        return not any(self.bad_cells.values())
+
+
+def encode_column(field, values):
+    """Labels or numbers (strings allowed, e.g. straight from a CSV) -> float64 codes.
+
+    Blank cells, unknown labels and other text that is not a number become
+    NaN, so validate() reports them with the rest instead of the parse failing.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in 'OUS':
+        return values.astype(np.float64)
+    values = np.char.strip(values.astype(str))
+    out = np.empty(len(values), dtype=np.float64)
+    done = (values == '') | (values == 'None')
+    out[done] = np.nan
+    for label, code in field.labels.items():
+        match = values == label
+        out[match] = code
+        done |= match
+    try:
+        out[~done] = values[~done].astype(np.float64)
+    except ValueError:
+        # Slow path only for columns with text that is neither a label nor a number
+        out[~done] = [_to_number(v) for v in values[~done]]
+    return out
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def encode_columns(columns):
+    """{feature: sequence} -> (n, 16) float matrix in model order."""
+    missing = [f for f in FEATURES if f not in columns]
+    if missing:
+        raise ValueError(f"missing features: {', '.join(missing)}")
+    return np.column_stack([encode_column(f, columns[f.name]) for f in SCHEMA])
+
+
+def _as_matrix(data):
+    if isinstance(data, np.ndarray) and data.dtype.names:
+        return to_matrix(data)
+    if isinstance(data, dict):
+        return encode_columns(data)
+    return np.asarray(data, dtype=np.float64).reshape(-1, len(SCHEMA))
+
+
+def validate(data, raw=None):
+    """Vectorized check of every cell against the schema.
+
+    data: (n, 16) matrix, structured records or {feature: column}. NaN (blank
+    or unparseable text), values outside the range, unknown codes and
+    fractions in integer fields are bad. raw: the {feature: column} an encoded
+    matrix came from, so the report shows the cells as given (implied for a
+    dict). -> ValidationReport: bad cell count, the first bad row indices and
+    their values per column, plus a boolean mask of the rows with no bad cell.
+    """
+    if isinstance(data, dict):
+        raw = data
+    X = _as_matrix(data)
+    bad = np.isnan(X)
+    for j, (field, col) in enumerate(zip(SCHEMA, X.T.copy())):    # contiguous columns
+        with np.errstate(invalid='ignore'):
+            if field.codes is not None:
+                bad[:, j] |= ~np.isin(col, field.codes)
+            else:
+                bad[:, j] |= (col < field.low) | (col > field.high)
+                if field.dtype.kind == 'u':
+                    bad[:, j] |= col != np.floor(col)
+    counts = bad.sum(axis=0)
+    bad_cells = {f.name: int(n) for f, n in zip(SCHEMA, counts)}
+    bad_rows = {f.name: np.flatnonzero(bad[:, j])[:MAX_REPORTED_ROWS].tolist()
+                for j, f in enumerate(SCHEMA) if counts[j]}
+    bad_values = {name: [_cell_value(raw[name][i] if raw is not None else X[i, FEATURES.index(name)])
+                         for i in rows]
+                  for name, rows in bad_rows.items()}
+    return ValidationReport(len(X), bad_cells, bad_rows, bad_values, ~bad.any(axis=1))
+
+
+def _cell_value(value):
+    # JSON-friendly: numbers stay numbers, NaN -> None, anything else as text
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value if isinstance(value, (int, float)) else str(value)
+
+
+def allowed_values(field):
+    if field.codes is not None:
+        return f"codes {sorted(field.codes.astype(int).tolist())}"
+    return f"{'whole numbers in ' if field.dtype.kind == 'u' else ''}[{field.low}, {field.high}]"
+
+
+def format_report(report):
+    lines = [f"{report.n_rows} rows, {int((~report.valid).sum())} with invalid cells"]
+    for field in SCHEMA:
+        n = report.bad_cells[field.name]
+        if n:
+            examples = ', '.join(f"row {i}: {v!r}" for i, v in zip(report.bad_rows[field.name],
+                                                                     report.bad_values[field.name]))
+            lines.append(f"  {field.name:24s} {n:8d} bad, {allowed_values(field)}, e.g. {examples}")
+    return '\n'.join(lines)
+
+
+def report_fields(report):
+    """JSON-friendly per-column report: {feature: {bad_cells, rows, values, allowed}} for the bad columns."""
+    return {field.name: {'bad_cells': report.bad_cells[field.name], 'rows': report.bad_rows[field.name],
+                         'values': report.bad_values[field.name], 'allowed': allowed_values(field)}
+            for field in SCHEMA if report.bad_cells[field.name]}
+
+
+def to_records(data):
+    """Validated data -> structured array of RECORD_DTYPE; ValueError if any cell is invalid."""
+    X = _as_matrix(data)
+    report = validate(X)
+    if not report.ok:
+        raise ValueError(format_report(report))
+    records = np.empty(len(X), dtype=RECORD_DTYPE)
+    for j, field in enumerate(SCHEMA):
+        records[field.name] = X[:, j]
+    return records
+
+
+def to_matrix(records):
+    """Structured records -> the model's (n, 16) float64 matrix, in FEATURES order."""
+    return recfunctions.structured_to_unstructured(records[FEATURES], dtype=np.float64)
+
+
+def main(argv=None):
+    from batch_predict import iter_chunks
+
+    parser = argparse.ArgumentParser(description="Validate a cohort file (CSV or Parquet) against the schema.")
+    parser.add_argument('input')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    n_rows = 0
+    bad_cells = dict.fromkeys(FEATURES, 0)
+    bad_rows = {}
+    bad_values = {}
+    valid = []
+    try:
+        for rows in iter_chunks(args.input, args.chunk_size):
+            report = validate({f: [row[f] for row in rows] for f in FEATURES})
+            for name, n in report.bad_cells.items():
+                bad_cells[name] += n
+            for name, idx in report.bad_rows.items():
+                seen = bad_rows.setdefault(name, [])
+                room = MAX_REPORTED_ROWS - len(seen)
+                seen.extend(n_rows + i for i in idx[:room])
+                bad_values.setdefault(name, []).extend(report.bad_values[name][:room])
+            valid.append(report.valid)
+            n_rows += report.n_rows
+    except ValueError as e:
+        parser.error(str(e))
+    report = ValidationReport(n_rows, bad_cells, bad_rows, bad_values, np.concatenate(valid or [np.ones(0, bool)]))
+    print(format_report(report))
+    return 0 if report.ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Result graphic without matplotlib.
+
+The base figure is decoded and downsampled once into a uint8 RGB buffer.
+The CI band and the mean line are composited directly into a copy of it
+with NumPy at the columns the former matplotlib create_plot used
+(110 + p * 800 in source pixels) and the result is PNG-encoded. Renders are
+cached per probability quantized to 0.1%, the precision shown in the UI.
+"""
+import io
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from predictor import IMAGE_PATH
+from startup import REPORT
+
+DISPLAY_WIDTH = 800
+X_OFFSET, X_SCALE = 110, 800   # source-pixel mapping of probability 0..1
+BAND_TOP = 0.88                # band/line cover the top 88% (axvspan ymin=0.12)
+RED = np.array([255, 0, 0], dtype=np.uint16)
+BAND_ALPHA = 3                 # tenths, i.e. alpha 0.3
+DASH_ON, DASH_OFF = 10, 5
+QUANTUM = 1000                 # 0.1% steps
+
+
+class BaseImage:
+    def __init__(self, pixels, scale):
+        self.pixels = pixels   # (H, W, 3) uint8, read-only
+        self.scale = scale     # display pixels per source pixel
+
+    def column(self, p):
+        x = (X_OFFSET + p * X_SCALE) * self.scale
+        return int(round(min(max(x, 0), self.pixels.shape[1] - 1)))
+
+
+def load_base(path=IMAGE_PATH, width=DISPLAY_WIDTH):
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        scale = min(1.0, width / img.width)
+        if scale < 1.0:
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+        pixels = np.asarray(img, dtype=np.uint8).copy()
+    pixels.flags.writeable = False
+    return BaseImage(pixels, scale)
+
+
+def composite(base, probs, ci_lower, ci_upper):
+    out = base.pixels.copy()
+    bottom = int(out.shape[0] * BAND_TOP)
+    x0, x1 = base.column(ci_lower), base.column(ci_upper)
+    band = out[:bottom, x0:x1 + 1].astype(np.uint16)
+    out[:bottom, x0:x1 + 1] = ((band * (10 - BAND_ALPHA) + RED * BAND_ALPHA) // 10).astype(np.uint8)
+
+    xm = base.column(probs)
+    rows = np.arange(bottom)
+    dashed = rows[(rows % (DASH_ON + DASH_OFF)) < DASH_ON]
+    out[dashed, max(xm - 1, 0):xm + 1] = (255, 0, 0)
+    return out
+
+
+def encode_png(pixels):
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='PNG', compress_level=1)
+    return buf.getvalue()
+
+
+def quantize(p):
+    return round(float(p) * QUANTUM)
+
+
+@lru_cache(maxsize=1)
+def default_base():
+    with REPORT.phase('image_decode'):
+        return load_base()
+
+
+@lru_cache(maxsize=256)
+def _render_quantized(q_probs, q_lower, q_upper):
+    base = default_base()
+    return encode_png(composite(base, q_probs / QUANTUM, q_lower / QUANTUM, q_upper / QUANTUM))
+
+
+def clear_render_cache():
+    _render_quantized.cache_clear()
+
+
+def render_png(probs, ci_lower, ci_upper):
+    """PNG bytes of the result graphic; raises OSError if the base image is missing."""
+    return _render_quantized(quantize(probs), quantize(ci_lower), quantize(ci_upper))
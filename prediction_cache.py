@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Canonical, hashable form of a feature vector (rounding removes float noise)
+def normalize_features(input_data):
+    return tuple(round(float(x), 6) for x in np.asarray(input_data, dtype=float).ravel())
+
+
+class PredictionCache:
+    """Thread-safe, size-bounded LRU of predictions shared by all sessions.
+
+    Keys are the normalized feature vector plus the model identity, so a new
+    model file never serves results computed by the old one.
+    """
+
+    def __init__(self, maxsize=4096, model_id=None):
+        self.maxsize = maxsize
+        self.model_id = model_id
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, input_data):
+        return (self.model_id, normalize_features(input_data))
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, input_data, compute):
+        # compute() runs outside the lock; concurrent misses may both compute
+        key = self.key(input_data)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __contains__(self, key):
+        # Membership only: no LRU update, not counted as a hit or miss
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
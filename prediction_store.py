@@ -0,0 +1,190 @@
+"""Persistent prediction store (SQLite) shared by all processes on a host.
+
+Each model file gets its own database next to its other cached artifacts,
+unless MDVO_STORE_PATH points all of them at one file.
+
+Rows are keyed by the model file name and SHA-256 plus a hash of the
+normalized feature vector, so a restarted or newly forked worker serves
+earlier predictions without touching the model, and a replaced model never
+sees the old model's rows (they are purged when the new version loads;
+other model files' rows in a shared file are left alone).
+
+WAL mode lets any number of worker processes read while one writes; each
+thread gets its own connection. The store is capped at `max_rows`; the
+oldest entries are evicted first.
+
+    python prediction_store.py prefill cohort.csv [--model ...]   # bulk-load from a batch run
+    python prediction_store.py stats
+    MDVO_STORE_PATH=/var/lib/mdvo/predictions.sqlite               # default: .model_cache/<model>.predictions.sqlite
+                                                                   # (one file shared by every model)
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from fit_cache import CACHE_DIR
+from inference_profiles import get_profile
+from prediction_cache import normalize_features
+from predictor import MODEL_PATH, EVT_THRESHOLD, DECISION_CI, model_digest, to_prediction
+
+MAX_ROWS = 1_000_000
+EVICT_CHECK_EVERY = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    model TEXT NOT NULL,
+    key BLOB NOT NULL,
+    probs REAL NOT NULL,
+    ci_lower REAL NOT NULL,
+    ci_upper REAL NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (model, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS predictions_stored_at ON predictions (stored_at);
+"""
+
+
+def store_path(model_path=MODEL_PATH):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.environ.get('MDVO_STORE_PATH') or os.path.join(CACHE_DIR, f"{name}.predictions.sqlite")
+
+
+def feature_key(input_data):
+    return hashlib.blake2b(repr(normalize_features(input_data)).encode(), digest_size=16).digest()
+
+
+class PredictionStore:
+    def __init__(self, path, model_id, max_rows=MAX_ROWS):
+        self.path = path
+        self.model_id = model_id
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    @classmethod
+    def for_model(cls, model_path=MODEL_PATH, path=None, digest=None, profile=None, **kwargs):
+        # '<file name>@<digest>:<decision ci>': rows computed with another decision
+        # interval are stale too; the name scopes purge_stale in a shared file
+        name = os.path.basename(model_path)
+        model_id = f"{name}@{digest or model_digest(model_path)}:{DECISION_CI}"
+        # Results of a reduced inference profile are kept apart from the full model's
+        if profile is not None and get_profile(profile).ensemble_fraction < 1:
+            model_id = f"{model_id}/{profile}"
+        return cls(path or store_path(model_path), model_id, **kwargs)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, input_data, threshold=EVT_THRESHOLD):
+        row = self._conn().execute(
+            'SELECT probs, ci_lower, ci_upper FROM predictions WHERE model = ? AND key = ?',
+            (self.model_id, feature_key(input_data))).fetchone()
+        return to_prediction(*row, threshold) if row else None
+
+    def put(self, input_data, prediction):
+        self.put_many(np.asarray(input_data, dtype=float).reshape(1, -1),
+                      [prediction.probs], [prediction.ci_lower], [prediction.ci_upper])
+
+    def put_many(self, X, probs, ci_lower, ci_upper):
+        now = time.time()
+        rows = [(self.model_id, feature_key(x), float(p), float(lo), float(hi), now)
+                for x, p, lo, hi in zip(np.asarray(X, dtype=float), probs, ci_lower, ci_upper)]
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)', rows)
+        with self._lock:
+            self._puts += len(rows)
+            check = self._puts >= EVICT_CHECK_EVERY
+            if check:
+                self._puts = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        # Trim to 90% of the cap so eviction does not run on every insert
+        conn = self._conn()
+        count = conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        if count <= self.max_rows:
+            return 0
+        excess = count - int(self.max_rows * 0.9)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM predictions WHERE (model, key) IN '
+                         '(SELECT model, key FROM predictions ORDER BY stored_at LIMIT ?)', (excess,))
+        return excess
+
+    def purge_stale(self):
+        """Drop rows of older versions of this model file or another interval; returns the number removed."""
+        # Ids are '<name>@<digest>:<decision ci>', plus '/<profile>' for a reduced inference profile.
+        # substr, not LIKE: file names often contain '_'
+        current = self.model_id.split('/')[0]
+        name = current.rpartition('@')[0] + '@'
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            return conn.execute(
+                'DELETE FROM predictions WHERE substr(model, 1, ?) = ? AND model != ? AND substr(model, 1, ?) != ?',
+                (len(name), name, current, len(current) + 1, current + '/')).rowcount
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            'path': self.path,
+            'rows': conn.execute('SELECT COUNT(*) FROM predictions WHERE model = ?', (self.model_id,)).fetchone()[0],
+            'max_rows': self.max_rows,
+            'bytes': os.path.getsize(self.path),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent prediction store")
+    parser.add_argument('command', choices=['prefill', 'stats', 'purge'])
+    parser.add_argument('cohort', nargs='?', help="cohort file (CSV/Parquet) for prefill")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--store', default=None, help="SQLite file (default: MDVO_STORE_PATH or .model_cache/)")
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    store = PredictionStore.for_model(args.model, args.store)
+    if args.command == 'stats':
+        print(store.stats())
+        return
+    if args.command == 'purge':
+        print(f"removed {store.purge_stale()} rows of older versions of {os.path.basename(args.model)}",
+              file=sys.stderr)
+        return
+    if not args.cohort:
+        parser.error("prefill needs a cohort file")
+
+    from batch_predict import iter_chunks, score_chunks
+    from predictor import load_clf
+
+    clf = load_clf(args.model)
+    n_rows = 0
+    try:
+        for rows, X, probs, ci_lower, ci_upper in score_chunks(clf, iter_chunks(args.cohort, args.chunk_size)):
+            store.put_many(X, probs, ci_lower, ci_upper)
+            n_rows += len(rows)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Stored {n_rows} predictions -> {store.path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
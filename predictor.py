@@ -0,0 +1,141 @@
+import hashlib
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from metrics import METRICS
+
+# Shared model logic (no Streamlit) - used by app.py and the headless tools
+MODEL_PATH = 'no_dominant_m2_24h_nihss_cpu.pkl'
+IMAGE_PATH = "Fig2_probabilites_good_outcome.png"
+
+# Feature order expected by the model (same order as create_input_data)
+FEATURES = [
+    'age', 'sex_numeric', 'onset_to_img', 'nihss', 'prestroke_mrs',
+    'antiplatelets_numeric', 'anticoagulants_numeric', 'ivt_numeric',
+    'hist_stroke_numeric', 'hist_tia_numeric', 'aht_numeric',
+    'diabetes_numeric', 'af_numeric', 'glucose', 'vessel_numeric', 'tissue_at_risk'
+]
+
+vessel_options = {"Non-/Co-dominant M2": 4, "M3 and more distal": 5, "A1": 6, "A2 and more distal": 7, "P1": 10, "P2 and more distal": 11}
+
+# Same conversions as the sidebar widgets, so headless inputs may use labels or codes
+LABEL_CODES = {
+    'sex_numeric': {"Male": 0, "Female": 1},
+    'ivt_numeric': {"No": 0, "Yes": 1},
+    'vessel_numeric': vessel_options,
+}
+
+# Sidebar widget domains: numeric (min, max, step); everything else is a code set
+NUMERIC_RANGES = {
+    'age': (18, 100, 1),
+    'onset_to_img': (0, 2000, 1),
+    'nihss': (0, 42, 1),
+    'prestroke_mrs': (0, 6, 1),
+    'glucose': (0.0, 40.0, 0.1),
+    'tissue_at_risk': (0.0, 500.0, 0.1),
+}
+CATEGORICAL_CODES = {f: (0, 1) for f in FEATURES if f not in NUMERIC_RANGES}
+CATEGORICAL_CODES['vessel_numeric'] = tuple(vessel_options.values())
+
+# HTE analysis: EVT harmful if lower CI bound of the BMT probability exceeds this
+EVT_THRESHOLD = 0.23
+# Names the interval behind ci_lower; persisted predictions (store, surrogate,
+# lookup table) record it and are ignored once it changes
+DECISION_CI = 'wald-500'
+
+# source: what answered - 'model', or a fast path ('lookup table', 'surrogate')
+Prediction = namedtuple('Prediction', ['probs', 'ci_lower', 'ci_upper', 'recommendation', 'source'],
+                        defaults=('model',))
+
+
+def load_clf(path=MODEL_PATH):
+    import joblib  # only needed once the model is actually loaded
+    return joblib.load(path)
+
+
+# Cheap identity of the model file, changes whenever the pickle is replaced
+def model_identity(path=MODEL_PATH):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+# Content hash of the model file, for artifacts that must survive restarts
+def model_digest(path=MODEL_PATH):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def encode_value(feature, value):
+    if isinstance(value, str):
+        value = value.strip()
+        codes = LABEL_CODES.get(feature)
+        if codes and value in codes:
+            return codes[value]
+    return float(value)
+
+
+def create_input_data(age, sex_numeric, onset_to_img, nihss, prestroke_mrs,
+                     antiplatelets_numeric, anticoagulants_numeric, ivt_numeric,
+                     hist_stroke_numeric, hist_tia_numeric, aht_numeric,
+                     diabetes_numeric, af_numeric, glucose, vessel_numeric, tissue_at_risk):
+    return np.array([[
+        age, sex_numeric, onset_to_img, nihss, prestroke_mrs,
+        antiplatelets_numeric, anticoagulants_numeric, ivt_numeric,
+        hist_stroke_numeric, hist_tia_numeric, aht_numeric,
+        diabetes_numeric, af_numeric, glucose, vessel_numeric, tissue_at_risk
+    ]])
+
+
+# Sidebar defaults: warm-up inference and the single-patient benchmarks
+DEFAULT_INPUT = (72, 0, 210, 6, 0, 0, 0, 0, 0, 0, 0, 0, 0, 6.6, 4, 30.0)
+
+
+# Uniform random inputs over the widget domains, snapped to the widget steps
+def sample_inputs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.empty((n, len(FEATURES)))
+    for i, feature in enumerate(FEATURES):
+        if feature in NUMERIC_RANGES:
+            low, high, step = NUMERIC_RANGES[feature]
+            X[:, i] = low + rng.integers(0, round((high - low) / step) + 1, n) * step
+        else:
+            X[:, i] = rng.choice(CATEGORICAL_CODES[feature], n)
+    return X.round(6)
+
+
+# Wald approximation: the interval behind ci_lower on every serving path.
+# Works on scalars and arrays alike
+def calculate_probs_ci(probs):
+    n_eff = 500
+    se = np.sqrt(probs * (1 - probs) / n_eff)
+    ci_lower = np.maximum(0, probs - 1.96 * se)
+    ci_upper = np.minimum(1, probs + 1.96 * se)
+    return ci_lower, ci_upper
+
+
+def evt_recommendation(ci_lower, threshold=EVT_THRESHOLD):
+    return "EVT Not Recommended" if ci_lower > threshold else "Consider EVT"
+
+
+# (n, 16) -> probs, ci_lower, ci_upper arrays
+def predict_batch(clf, input_data):
+    METRICS.inc('rows_scored', len(input_data))
+    with METRICS.timer('predict_proba'):
+        probs = clf.predict_proba(input_data)[:, 1]
+    with METRICS.timer('ci'):
+        ci_lower, ci_upper = calculate_probs_ci(probs)
+    return probs, ci_lower, ci_upper
+
+
+def to_prediction(probs, ci_lower, ci_upper, threshold=EVT_THRESHOLD, source='model'):
+    return Prediction(float(probs), float(ci_lower), float(ci_upper), evt_recommendation(ci_lower, threshold),
+                      source)
+
+
+def predict_one(clf, input_data):
+    return to_prediction(*(v[0] for v in predict_batch(clf, input_data)))
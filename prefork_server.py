@@ -0,0 +1,217 @@
+"""Pre-fork deployment of the JSON API with shared model memory.
+
+The parent loads and warms the model once, moves large arrays into
+memory-mapped files and torch tensors into shared memory, freezes the GC
+(so collections in the workers do not dirty the inherited pages) and then
+forks the workers. Every worker serves api_server on the same listening
+socket; model pages stay shared instead of being duplicated per worker.
+
+    python prefork_server.py --workers 4 --port 8502
+    python prefork_server.py --workers 4 --measure    # print per-worker RSS/PSS and exit
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import types
+
+import numpy as np
+
+from api_server import PredictionService, serve
+from fit_cache import load_warm_model
+from predictor import MODEL_PATH, DEFAULT_INPUT, create_input_data
+
+logger = logging.getLogger('mdvo.prefork')
+
+MMAP_MIN_BYTES = 1 << 16   # smaller arrays are not worth a file
+
+
+def _to_memmap(arr, directory, counter):
+    path = os.path.join(directory, f"array_{counter[0]}.npy")
+    counter[0] += 1
+    np.save(path, arr)
+    # copy-on-write mapping: reads share the page cache, writes stay private
+    return np.load(path, mmap_mode='c')
+
+
+def share_model_memory(obj, directory, _seen=None, _counter=None):
+    """Move large numpy arrays to mmap'd files and torch tensors to shared memory, in place."""
+    try:
+        import torch
+    except ImportError:
+        torch = None
+    seen = _seen if _seen is not None else set()
+    counter = _counter if _counter is not None else [0]
+    if id(obj) in seen:
+        return obj
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        if obj.nbytes >= MMAP_MIN_BYTES and obj.dtype != object and not isinstance(obj, np.memmap):
+            return _to_memmap(obj, directory, counter)
+        return obj
+    if torch is not None and isinstance(obj, torch.Tensor):
+        try:
+            obj.share_memory_()
+        except RuntimeError:
+            pass  # e.g. inference-mode tensors; they stay in inherited copy-on-write pages
+        return obj
+    if isinstance(obj, (str, bytes, int, float, bool, type(None), type, types.ModuleType,
+                        types.FunctionType, types.BuiltinFunctionType)):
+        return obj
+
+    def share(value):
+        return share_model_memory(value, directory, seen, counter)
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            obj[key] = share(value)
+    elif isinstance(obj, list):
+        for i, value in enumerate(obj):
+            obj[i] = share(value)
+    elif isinstance(obj, tuple):
+        for value in obj:
+            share(value)
+    elif torch is not None and isinstance(obj, torch.nn.Module):
+        obj.share_memory()
+        for value in vars(obj).values():
+            share(value)
+    elif hasattr(obj, '__dict__'):
+        for key, value in list(vars(obj).items()):
+            shared = share(value)
+            if shared is not value:
+                try:
+                    setattr(obj, key, shared)
+                except AttributeError:
+                    pass
+    return obj
+
+
+def memory_usage(pid):
+    # Linux only: MB of RSS, PSS (shared pages divided among sharers) and private memory
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0].rstrip(':') in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                usage[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': usage.get('Rss', 0.0),
+        'pss_mb': usage.get('Pss', 0.0),
+        'private_mb': usage.get('Private_Clean', 0.0) + usage.get('Private_Dirty', 0.0),
+    }
+
+
+def print_memory_report(pids):
+    print(f"{'pid':>8} {'RSS MB':>10} {'PSS MB':>10} {'private MB':>11}")
+    total_pss = 0.0
+    for pid in pids:
+        usage = memory_usage(pid)
+        total_pss += usage['pss_mb']
+        print(f"{pid:>8} {usage['rss_mb']:10.1f} {usage['pss_mb']:10.1f} {usage['private_mb']:11.1f}")
+    print(f"{'total PSS':>8} {total_pss:10.1f}")
+
+
+def run_worker(sock, service_kwargs, keepalive_timeout):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    async def run():
+        service = PredictionService(**service_kwargs)
+        await serve(None, None, service, keepalive_timeout, sock=sock)
+
+    asyncio.run(run())
+
+
+def fork_worker(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            target(*args)
+        except BaseException:
+            logger.exception("worker crashed")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def measure_worker(ready_fd, service_kwargs):
+    # Loads the service like a real worker, runs one prediction, then idles until killed
+    service = PredictionService(**service_kwargs)
+    service.batcher.predict(create_input_data(*DEFAULT_INPUT))
+    os.write(ready_fd, b'1')
+    while True:
+        time.sleep(3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork MDVO JSON API with shared model memory")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() // 2))
+    parser.add_argument('--mmap-dir', default=None, help="directory for memory-mapped arrays (default: temp dir)")
+    parser.add_argument('--max-pending', type=int, default=64)
+    parser.add_argument('--keepalive-timeout', type=float, default=15.0)
+    parser.add_argument('--measure', action='store_true', help="fork workers, print RSS/PSS, exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(process)d %(levelname)s %(message)s")
+
+    mmap_dir = args.mmap_dir or tempfile.mkdtemp(prefix='mdvo-mmap-')
+    os.makedirs(mmap_dir, exist_ok=True)
+    clf = load_warm_model(args.model)
+    share_model_memory(clf, mmap_dir)
+    if args.mmap_dir is None:
+        shutil.rmtree(mmap_dir)  # mappings stay valid and are inherited by (re)forked workers
+    service_kwargs = dict(model_path=args.model, max_pending=args.max_pending, clf=clf)
+    gc.collect()
+    gc.freeze()
+
+    if args.measure:
+        read_fd, write_fd = os.pipe()
+        pids = [fork_worker(measure_worker, write_fd, service_kwargs) for _ in range(args.workers)]
+        for _ in pids:
+            os.read(read_fd, 1)
+        print(f"parent {os.getpid()} (model loaded once), {args.workers} workers:")
+        print_memory_report([os.getpid()] + pids)
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        return
+
+    sock = socket.create_server((args.host, args.port), backlog=512, reuse_port=False)
+    sock.setblocking(False)
+    workers = {fork_worker(run_worker, sock, service_kwargs, args.keepalive_timeout) for _ in range(args.workers)}
+    logger.info("serving on http://%s:%d with %d workers", args.host, args.port, len(workers))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # Supervise: replace workers that die, until asked to stop
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            logger.warning("worker %d exited (status %d), restarting", pid, status)
+            workers.add(fork_worker(run_worker, sock, service_kwargs, args.keepalive_timeout))
+
+
+if __name__ == '__main__':
+    main()
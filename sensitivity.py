@@ -0,0 +1,86 @@
+"""What-if sensitivity curves for one feature of the current patient.
+
+The sweep of a feature across its sidebar widget range is built as one
+matrix and scored in a single predict_batch call (point estimate and CI
+together). Curves are cached per patient profile - the input with the swept
+feature left out - so moving that widget, switching features or coming back
+to a patient does not call the model again.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from metrics import METRICS
+from prediction_cache import PredictionCache, normalize_features
+from predictor import FEATURES, EVT_THRESHOLD, predict_batch
+
+# Sidebar widget ranges (label, grid)
+SWEEPS = {
+    'onset_to_img': ("Time from onset to imaging (min)", np.arange(0, 2001, 20, dtype=float)),
+    'nihss': ("NIHSS at admission", np.arange(0, 43, dtype=float)),
+    'tissue_at_risk': ("Tissue at risk (Tmax>6s, ml)", np.arange(0, 501, 5, dtype=float)),
+}
+
+Curve = namedtuple('Curve', ['feature', 'values', 'probs', 'ci_lower', 'ci_upper'])
+
+
+def sweep_matrix(input_data, feature):
+    values = SWEEPS[feature][1]
+    X = np.repeat(np.asarray(input_data, dtype=float).reshape(1, -1), len(values), axis=0)
+    X[:, FEATURES.index(feature)] = values
+    return values, X
+
+
+def profile_key(input_data, feature):
+    row = np.asarray(input_data, dtype=float).reshape(-1)
+    return feature, normalize_features(np.delete(row, FEATURES.index(feature)))
+
+
+def sensitivity_curve(clf, input_data, feature, score=None):
+    # score: X -> (probs, ci_lower, ci_upper), e.g. through the batcher; default calls the model here
+    values, X = sweep_matrix(input_data, feature)
+    with METRICS.timer('sensitivity_curve'):
+        probs, ci_lower, ci_upper = score(X) if score is not None else predict_batch(clf, X)
+    return Curve(feature, values, np.asarray(probs), np.asarray(ci_lower), np.asarray(ci_upper))
+
+
+def cached_curve(cache, clf, input_data, feature, score=None):
+    key = (cache.model_id, profile_key(input_data, feature))
+    curve = cache.get(key)
+    if curve is None:
+        curve = sensitivity_curve(clf, input_data, feature, score)
+        cache.put(key, curve)
+    return curve
+
+
+def curve_cache(model_id, maxsize=256):
+    # ~100 points x 3 arrays per curve, so a few hundred profiles stay small
+    return PredictionCache(maxsize=maxsize, model_id=model_id)
+
+
+def curve_chart(curve, current_value, threshold=EVT_THRESHOLD):
+    """Altair chart: probability with CI band, the ci_lower threshold (0.23 by default) and the current value."""
+    import altair as alt
+    import pandas as pd
+
+    label = SWEEPS[curve.feature][0]
+    data = pd.DataFrame({
+        'value': curve.values,
+        'probability': curve.probs,
+        'ci_lower': curve.ci_lower,
+        'ci_upper': curve.ci_upper,
+        'recommendation': np.where(curve.ci_lower > threshold, "EVT Not Recommended", "Consider EVT"),
+    })
+    x = alt.X('value:Q', title=label)
+    band = alt.Chart(data).mark_area(opacity=0.25).encode(
+        x=x, y=alt.Y('ci_lower:Q', title="Probability", scale=alt.Scale(domain=[0, 1]), axis=alt.Axis(format='%')),
+        y2='ci_upper:Q')
+    line = alt.Chart(data).mark_line().encode(
+        x=x, y='probability:Q',
+        tooltip=[alt.Tooltip('value:Q', title=label), alt.Tooltip('probability:Q', format='.1%'),
+                 alt.Tooltip('ci_lower:Q', format='.1%'), alt.Tooltip('ci_upper:Q', format='.1%'),
+                 'recommendation:N'])
+    lower = alt.Chart(data).mark_line(strokeDash=[2, 2]).encode(x=x, y='ci_lower:Q')
+    rule = alt.Chart(pd.DataFrame({'y': [threshold]})).mark_rule(color='#dc2626', strokeDash=[6, 4]).encode(y='y:Q')
+    current = alt.Chart(pd.DataFrame({'x': [current_value]})).mark_rule(color='#f59e0b').encode(x='x:Q')
+    return band + line + lower + rule + current
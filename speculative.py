@@ -0,0 +1,190 @@
+"""Speculative precompute of the likely next inputs (opt-in).
+
+After a prediction is shown, its one-step neighbours - NIHSS +-1, onset to
+imaging +-30 min, each medical-history/medication checkbox toggled - are
+scored in small batches in a low-priority background thread and put into
+the shared prediction cache, so the next "Predict Outcome" after a nudge
+is usually a cache hit.
+
+The thread runs at the lowest OS priority, waits before every batch while
+the batcher has real requests queued or in flight, and sleeps after each
+one so it uses at most MDVO_SPECULATE_CPU of one core. Batches are
+BATCH_ROWS rows, so a real request never waits behind more than one of
+them. Only the newest request is kept: a newer one replaces the rest of
+the current neighbours.
+
+    MDVO_SPECULATE=1  MDVO_SPECULATE_CPU=0.25
+    metrics: speculative_rows, speculative_hits, speculative_hit_rate, speculative_dropped
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from inference_profiles import set_intra_op_threads
+from metrics import METRICS
+from predictor import FEATURES, NUMERIC_RANGES, EVT_THRESHOLD, predict_batch, to_prediction
+
+logger = logging.getLogger('mdvo.speculative')
+
+ENABLED = os.environ.get('MDVO_SPECULATE', '0').lower() in ('1', 'on', 'true')
+CPU_BUDGET = float(os.environ.get('MDVO_SPECULATE_CPU', 0.25))
+STEPS = {'nihss': (-1, 1), 'onset_to_img': (-30, 30)}
+TOGGLES = ('antiplatelets_numeric', 'anticoagulants_numeric', 'hist_stroke_numeric', 'hist_tia_numeric',
+           'aht_numeric', 'diabetes_numeric', 'af_numeric')
+# Give up on a request when real traffic keeps the model busy this long
+MAX_YIELD_SECONDS = 5.0
+TRACKED_KEYS = 4096
+BATCH_ROWS = 2
+
+
+def neighbors(input_data):
+    """(n, 16) one-step variants of the row, within the widget ranges."""
+    row = np.asarray(input_data, dtype=float).reshape(-1)
+    out = []
+    for feature, deltas in STEPS.items():
+        col = FEATURES.index(feature)
+        low, high, _ = NUMERIC_RANGES[feature]
+        for delta in deltas:
+            if low <= row[col] + delta <= high:
+                variant = row.copy()
+                variant[col] += delta
+                out.append(variant)
+    for feature in TOGGLES:
+        variant = row.copy()
+        variant[FEATURES.index(feature)] = 1 - variant[FEATURES.index(feature)]
+        out.append(variant)
+    return np.array(out)
+
+
+class Speculator:
+    def __init__(self, clf, cache, batcher=None, cpu_budget=CPU_BUDGET, threshold=EVT_THRESHOLD):
+        self.clf = clf
+        self.threshold = threshold
+        self.cache = cache
+        self.batcher = batcher
+        self.cpu_budget = cpu_budget
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._next = None
+        self._closed = False
+        self._speculated = OrderedDict()    # cache keys filled speculatively, not yet hit
+        self.rows = 0
+        self.hits = 0
+        self.dropped = 0
+        self.cpu_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name='speculative', daemon=True)
+        self._thread.start()
+        METRICS.register_collector(self.gauges)
+
+    def close(self):
+        # Stops the thread after the batch in progress and drops the metrics collector
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._next = None
+            self._wakeup.notify()
+        METRICS.unregister_collector(self.gauges)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def submit(self, input_data):
+        # Replaces a request that has not started yet; ignored once closed
+        with self._lock:
+            if self._closed:
+                return
+            if self._next is not None:
+                self.dropped += 1
+                METRICS.inc('speculative_dropped')
+            self._next = np.asarray(input_data, dtype=float).reshape(-1)
+            self._wakeup.notify()
+
+    def note_lookup(self, key, hit):
+        # Called on every cache lookup of a real request; counts hits on speculated keys
+        if not hit:
+            return
+        with self._lock:
+            if self._speculated.pop(key, None) is not None:
+                self.hits += 1
+                METRICS.inc('speculative_hits')
+
+    def _yield_to_requests(self):
+        deadline = time.monotonic() + MAX_YIELD_SECONDS
+        while self.batcher is not None and not self.batcher.idle():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass  # not Linux: yielding and the CPU budget still apply
+        set_intra_op_threads(None)
+        while True:
+            with self._lock:
+                while self._next is None and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                row, self._next = self._next, None
+            X = np.array([x for x in neighbors(row) if self.cache.key(x) not in self.cache])
+            for i in range(0, len(X), BATCH_ROWS):
+                with self._lock:
+                    superseded = self._next is not None or self._closed
+                if superseded:
+                    break
+                if not self._yield_to_requests():
+                    with self._lock:
+                        self.dropped += 1
+                    METRICS.inc('speculative_dropped')
+                    break
+                if not self._score(X[i:i + BATCH_ROWS]):
+                    break
+
+    def _score(self, X):
+        # One small batch into the cache, then the CPU-budget sleep; False on failure
+        start = time.thread_time()
+        try:
+            with METRICS.timer('speculative_batch'):
+                probs, ci_lower, ci_upper = predict_batch(self.clf, X)
+        except Exception:
+            logger.exception("speculative batch failed")
+            return False
+        cpu = time.thread_time() - start
+        for x, p, lo, hi in zip(X, probs, ci_lower, ci_upper):
+            key = self.cache.key(x)
+            self.cache.put(key, to_prediction(p, lo, hi, self.threshold))
+            with self._lock:
+                self._speculated[key] = True
+                while len(self._speculated) > TRACKED_KEYS:
+                    self._speculated.popitem(last=False)
+        with self._lock:
+            self.rows += len(X)
+            self.cpu_seconds += cpu
+        METRICS.inc('speculative_rows', len(X))
+        # Stay at cpu_budget of one core on average
+        time.sleep(cpu * (1 / self.cpu_budget - 1))
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rows': self.rows,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.rows if self.rows else 0.0,
+                'dropped': self.dropped,
+                'cpu_seconds': self.cpu_seconds,
+                'cpu_budget': self.cpu_budget,
+            }
+
+    def gauges(self):
+        stats = self.stats()
+        return {'speculative_hit_rate': stats['hit_rate'], 'speculative_cpu_seconds': stats['cpu_seconds']}
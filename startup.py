@@ -0,0 +1,178 @@
+"""Fast cold start: the model loads and warms up in a background thread.
+
+The Streamlit script only needs Streamlit and numpy to draw the sidebar and
+instructions; the TabPFN/torch stack, the unpickle, the training-context
+warm-up and the first inference happen in ModelLoader's thread while the
+page is already usable. Each phase is timed into REPORT:
+
+    python startup.py [--model no_dominant_m2_24h_nihss_cpu.pkl]
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRICS, process_rss_bytes
+from predictor import MODEL_PATH, DEFAULT_INPUT, create_input_data, model_digest, model_identity
+
+logger = logging.getLogger('mdvo.startup')
+
+class StartupReport:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = seconds
+            METRICS.observe(f'startup_{name}', seconds)
+            METRICS.record_memory(f'startup_{name}')
+
+    def summary(self):
+        with self._lock:
+            return ' '.join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+
+
+REPORT = StartupReport()
+
+
+class ModelLoader:
+    """Loads model, batcher, Shapley background, fast paths and store off the script thread."""
+
+    def __init__(self, model_path=MODEL_PATH, report=REPORT, profile=None):
+        from inference_profiles import DEFAULT_PROFILE, get_profile
+
+        self.model_path = model_path
+        self.report = report
+        self.profile_name = profile or DEFAULT_PROFILE
+        get_profile(self.profile_name)  # unknown names fail here, not in the thread
+        try:
+            # The file version this loader serves; per-model caches key on it
+            self.identity = model_identity(model_path)
+        except OSError:
+            self.identity = None
+        self.clf = None
+        self.batcher = None
+        self.explainer = None
+        self.surrogate = None
+        self.table = None
+        self.store = None
+        self.error = None
+        self.memory_bytes = 0
+        self._full_clf = None
+        self._profiles = {}
+        self._on_close = []             # callbacks run by close(), e.g. the app's speculator
+        self._profiles_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._load, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        rss_before = process_rss_bytes()
+        try:
+            with self.report.phase('imports'):
+                try:
+                    import torch  # noqa: F401  (pulled in by the pickle anyway)
+                    import tabpfn  # noqa: F401
+                except ImportError:
+                    pass
+                from attribution import ShapleyExplainer
+                from fit_cache import load_warm_model
+                from inference_profiles import ProfiledModel
+                from lookup_table import load_table
+                from prediction_store import PredictionStore
+                from surrogate import load_surrogate
+            with self.report.phase('unpickle'):
+                clf = load_warm_model(self.model_path)
+            primary = ProfiledModel(clf, self.profile_name, max_pending=int(os.environ.get('MDVO_MAX_PENDING', 256)))
+            with self.report.phase('first_inference'):
+                primary.batcher.predict(create_input_data(*DEFAULT_INPUT))
+            with self.report.phase('shap_background'):
+                explainer = ShapleyExplainer(primary.clf)
+            digest = model_digest(self.model_path)
+            with self.report.phase('surrogate'):
+                self.surrogate = load_surrogate(self.model_path, digest=digest)
+            with self.report.phase('lookup_table'):
+                self.table = load_table(self.model_path, digest=digest)
+            with self.report.phase('prediction_store'):
+                # Rows of a previous model file are dropped as soon as a new one loads
+                store = PredictionStore.for_model(self.model_path, digest=digest, profile=self.profile_name)
+                store.purge_stale()
+                self.store = store
+            self._full_clf = clf
+            self._profiles[self.profile_name] = primary
+            self.clf, self.batcher, self.explainer = primary.clf, primary.batcher, explainer
+            # RSS growth is noisy with several loaders at once; the file size is a floor
+            self.memory_bytes = max(process_rss_bytes() - rss_before, os.path.getsize(self.model_path))
+            logger.info("model ready: %s", self.report.summary())
+        except Exception as e:
+            self.error = e
+            logger.exception("model failed to load")
+        finally:
+            self._ready.set()
+
+    def profiled(self, name=None):
+        """The loaded model under another inference profile (built on first use); needs ready."""
+        from inference_profiles import ProfiledModel
+
+        name = name or self.profile_name
+        if self._full_clf is None:
+            # Not cached: a profile built on a missing model would stay broken after the load
+            raise RuntimeError("model is not loaded yet (call wait() first)")
+        with self._profiles_lock:
+            if name not in self._profiles:
+                self._profiles[name] = ProfiledModel(self._full_clf, name, max_pending=int(os.environ.get('MDVO_MAX_PENDING', 256)))
+            return self._profiles[name]
+
+    def on_close(self, fn):
+        # fn() runs when the model is retired (unloaded or replaced by a new version)
+        with self._profiles_lock:
+            self._on_close.append(fn)
+
+    def close(self):
+        # Batchers answer what is already queued, then later calls run inline
+        with self._profiles_lock:
+            for profiled in self._profiles.values():
+                profiled.batcher.close()
+            callbacks, self._on_close = self._on_close, []
+        for fn in callbacks:
+            fn()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        if not self._ready.wait(timeout):
+            raise TimeoutError("model is still warming up")
+        if self.error is not None:
+            raise RuntimeError(f"model failed to load: {self.error}") from self.error
+        return self
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time each cold-start phase")
+    parser.add_argument('--model', default=MODEL_PATH)
+    args = parser.parse_args()
+
+    # Use the importable module so phases recorded by plot_overlay land in the same report
+    import startup
+    from plot_overlay import default_base
+
+    startup.ModelLoader(args.model).wait()
+    default_base()
+    for name, seconds in startup.REPORT.phases.items():
+        print(f"{name:16s} {seconds * 1000:9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
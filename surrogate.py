@@ -0,0 +1,238 @@
+"""Distilled fast-path surrogate of the TabPFN model.
+
+A small ensemble of MLPs (scikit-learn for training, plain NumPy matmuls
+at serving time) is trained to reproduce the full model's probability on a
+large synthetic sample over the sidebar widget ranges. The CI bounds are
+derived from that probability with predictor.calculate_probs_ci, exactly
+as on every other path, so the decision rule is the teacher's. The app
+serves from the surrogate and falls back to the full model when
+
+- the input lies outside the sampled support,
+- the ensemble members disagree (std of probs above `max_std`), or
+- the predicted ci_lower is within `decision_margin` of the model's EVT
+  threshold, where the surrogate's error could flip the recommendation.
+
+    python surrogate.py distill [--model no_dominant_m2_24h_nihss_cpu.pkl] [--samples 50000]
+    python surrogate.py report  [--model ...]     # fidelity + latency of an existing artifact
+
+The artifact records the full model's content hash and the decision interval
+it was calibrated with, and is ignored once either changes.
+"""
+import argparse
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+
+from predictor import (MODEL_PATH, FEATURES, NUMERIC_RANGES, CATEGORICAL_CODES, EVT_THRESHOLD, DECISION_CI,
+                       calculate_probs_ci, model_digest, predict_batch, sample_inputs)
+
+# Bump when the artifact layout changes
+SURROGATE_FORMAT = 2
+TARGETS = ('probs', 'ci_lower', 'ci_upper')     # reported; only probs is regressed
+N_MEMBERS = 3
+HIDDEN = (64, 64)
+MAX_STD = 0.02
+_VESSEL_CODES = np.array(CATEGORICAL_CODES['vessel_numeric'], dtype=float)
+_VESSEL_COL = FEATURES.index('vessel_numeric')
+
+
+def encode(X):
+    # Numeric features scaled to [0, 1] over the widget range, binaries as-is, vessel one-hot
+    X = np.asarray(X, dtype=float)
+    cols = []
+    for i, feature in enumerate(FEATURES):
+        if feature in NUMERIC_RANGES:
+            low, high, _ = NUMERIC_RANGES[feature]
+            cols.append((X[:, i] - low) / (high - low))
+        elif i != _VESSEL_COL:
+            cols.append(X[:, i])
+    return np.column_stack(cols + [X[:, _VESSEL_COL, None] == _VESSEL_CODES]).astype(float)
+
+
+def surrogate_path(model_path=MODEL_PATH):
+    return os.environ.get('MDVO_SURROGATE') or f"{os.path.splitext(model_path)[0]}.surrogate.joblib"
+
+
+def teacher_labels(clf, X, chunk_size=1024):
+    out = [predict_batch(clf, X[i:i + chunk_size]) for i in range(0, len(X), chunk_size)]
+    return np.column_stack([np.concatenate([np.asarray(o[k]) for o in out]) for k in range(3)])
+
+
+class Surrogate:
+    def __init__(self, members, metadata):
+        self.members = members          # [(weights, biases), ...] one per ensemble member
+        self.metadata = metadata
+        self.decision_margin = metadata['decision_margin']
+        self.max_std = metadata['max_std']
+
+    @classmethod
+    def fit(cls, X, y, metadata, seed=0):
+        # y: the teacher's probs
+        from sklearn.neural_network import MLPRegressor
+
+        Z = encode(X)
+        members = []
+        for m in range(N_MEMBERS):
+            mlp = MLPRegressor(hidden_layer_sizes=HIDDEN, alpha=1e-5, batch_size=256, learning_rate_init=1e-3,
+                               max_iter=200, early_stopping=True, n_iter_no_change=10, random_state=seed + m)
+            mlp.fit(Z, y)
+            members.append(([w.astype(np.float32) for w in mlp.coefs_],
+                            [b.astype(np.float32) for b in mlp.intercepts_]))
+        return cls(members, metadata)
+
+    @staticmethod
+    def _forward(Z, weights, biases):
+        for w, b in zip(weights[:-1], biases[:-1]):
+            Z = np.maximum(Z @ w + b, 0)
+        return Z @ weights[-1] + biases[-1]
+
+    def in_support(self, X):
+        ok = np.ones(len(X), dtype=bool)
+        for i, feature in enumerate(FEATURES):
+            if feature in NUMERIC_RANGES:
+                low, high, _ = NUMERIC_RANGES[feature]
+                ok &= (X[:, i] >= low) & (X[:, i] <= high)
+            else:
+                ok &= np.isin(X[:, i], CATEGORICAL_CODES[feature])
+        return ok
+
+    def predict(self, X, threshold=EVT_THRESHOLD):
+        """-> (probs, ci_lower, ci_upper, trusted); rows with trusted=False need the full model."""
+        X = np.asarray(X, dtype=float).reshape(-1, len(FEATURES))
+        Z = encode(X).astype(np.float32)
+        preds = np.array([self._forward(Z, w, b).reshape(len(Z)) for w, b in self.members])   # (members, rows)
+        probs = np.clip(preds.mean(axis=0), 0, 1).astype(float)
+        ci_lower, ci_upper = calculate_probs_ci(probs)
+        trusted = (self.in_support(X)
+                   & (preds.std(axis=0) <= self.max_std)
+                   & (np.abs(ci_lower - threshold) >= self.decision_margin))
+        return probs, ci_lower, ci_upper, trusted
+
+    def predict_one(self, input_data, threshold=EVT_THRESHOLD):
+        # -> (probs, ci_lower, ci_upper) or None when the full model must answer
+        probs, ci_lower, ci_upper, trusted = self.predict(input_data, threshold)
+        return (probs[0], ci_lower[0], ci_upper[0]) if trusted[0] else None
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        joblib.dump({'format': SURROGATE_FORMAT, 'members': self.members, 'metadata': self.metadata}, tmp, compress=3)
+        os.replace(tmp, path)
+
+
+def load_surrogate(model_path=MODEL_PATH, path=None, digest=None):
+    """The surrogate for this model file, or None (missing, disabled, stale or unreadable)."""
+    path = path or surrogate_path(model_path)
+    if os.environ.get('MDVO_SURROGATE', '').lower() in ('0', 'off') or not os.path.exists(path):
+        return None
+    try:
+        artifact = joblib.load(path)
+    except Exception:
+        return None
+    if artifact.get('format') != SURROGATE_FORMAT:
+        return None
+    if artifact['metadata']['teacher_digest'] != (digest or model_digest(model_path)):
+        return None
+    if artifact['metadata'].get('decision_ci') != DECISION_CI:
+        return None
+    return Surrogate(artifact['members'], artifact['metadata'])
+
+
+def fidelity(surrogate, X, Y):
+    probs, ci_lower, ci_upper, trusted = surrogate.predict(X)
+    err = np.abs(np.column_stack([probs, ci_lower, ci_upper]) - Y)
+    decision, teacher_decision = ci_lower > EVT_THRESHOLD, Y[:, 1] > EVT_THRESHOLD
+    return {
+        'n': len(X),
+        'max_abs_error': dict(zip(TARGETS, err.max(axis=0).round(5).tolist())),
+        'mean_abs_error': dict(zip(TARGETS, err.mean(axis=0).round(5).tolist())),
+        'decision_agreement_surrogate_only': float(np.mean(decision == teacher_decision)),
+        # fallback rows are answered by the full model, so they always agree
+        'decision_agreement_served': float(np.mean(np.where(trusted, decision == teacher_decision, True))),
+        'fallback_rate': float(1 - trusted.mean()),
+    }
+
+
+def latency(clf, surrogate, repeat=20):
+    def per_call_ms(fn, X):
+        fn(X)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(X)
+        return (time.perf_counter() - start) / repeat * 1000
+
+    out = {}
+    for n in (1, 256):
+        X = sample_inputs(n, seed=99)
+        out[f'full_model_batch_{n}_ms'] = per_call_ms(lambda X: predict_batch(clf, X), X)
+        out[f'surrogate_batch_{n}_ms'] = per_call_ms(surrogate.predict, X)
+    return out
+
+
+def distill(clf, model_path, n_samples, n_test, seed=0):
+    X = sample_inputs(n_samples + n_test, seed=seed)
+    start = time.perf_counter()
+    Y = teacher_labels(clf, X)
+    labelling_s = time.perf_counter() - start
+    # Held-out rows: first half calibrates the decision margin, second half is reported
+    X_train, Y_train = X[:n_samples], Y[:n_samples]
+    X_cal, Y_cal = X[n_samples:n_samples + n_test // 2], Y[n_samples:n_samples + n_test // 2]
+    X_test, Y_test = X[n_samples + n_test // 2:], Y[n_samples + n_test // 2:]
+    metadata = {'decision_margin': 0.0, 'max_std': MAX_STD}
+    probe = Surrogate.fit(X_train, Y_train[:, 0], metadata, seed=seed)
+    # Near-threshold cases (within the 99th percentile of ci_lower error) go to the full model
+    ci_error = np.abs(probe.predict(X_cal)[1] - Y_cal[:, 1])
+    metadata.update(
+        decision_margin=float(np.quantile(ci_error, 0.99)),
+        teacher_digest=model_digest(model_path),
+        decision_ci=DECISION_CI,
+        teacher_file=os.path.basename(model_path),
+        created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        sklearn_version=__import__('sklearn').__version__,
+        hidden=list(HIDDEN),
+        members=N_MEMBERS,
+        n_train=n_samples,
+        labelling_seconds=round(labelling_s, 1),
+    )
+    probe.decision_margin = metadata['decision_margin']
+    probe.metadata = metadata
+    return probe, X_test, Y_test
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the full model into a fast surrogate")
+    parser.add_argument('command', choices=['distill', 'report'])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--out', default=None, help="artifact path (default: next to the model)")
+    parser.add_argument('--samples', type=int, default=50000)
+    parser.add_argument('--test-samples', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from fit_cache import load_warm_model
+
+    path = args.out or surrogate_path(args.model)
+    clf = load_warm_model(args.model)
+    if args.command == 'distill':
+        surrogate, X_test, Y_test = distill(clf, args.model, args.samples, args.test_samples, args.seed)
+    else:
+        surrogate = load_surrogate(args.model, path)
+        if surrogate is None:
+            parser.error(f"no surrogate for {args.model} at {path} (run 'distill' first)")
+        X_test = sample_inputs(args.test_samples, seed=args.seed + 1)
+        Y_test = teacher_labels(clf, X_test)
+
+    report = {'fidelity': fidelity(surrogate, X_test, Y_test), 'latency': latency(clf, surrogate)}
+    if args.command == 'distill':
+        surrogate.metadata['report'] = report
+        surrogate.save(path)
+        report['artifact'] = {'path': path, 'bytes': os.path.getsize(path)}
+    report['metadata'] = {k: v for k, v in surrogate.metadata.items() if k != 'report'}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+# Flat layout: the modules live in the repo root. Derived artifacts (fit
+# context, surrogate, lookup table, prediction store) go to a scratch directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MDVO_CACHE_DIR', tempfile.mkdtemp(prefix='mdvo-test-cache-'))
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from predictor import DEFAULT_INPUT, sample_inputs
+
+
+def make_clf(seed=0):
+    # Small stand-in for the TabPFN model: same 16 inputs, an ensemble the profiles can subset
+    X = sample_inputs(400, seed=seed)
+    y = (X[:, 3] + 2 * X[:, 4] + np.random.default_rng(seed).normal(0, 3, len(X)) > 10).astype(int)
+    return RandomForestClassifier(n_estimators=8, max_depth=4, random_state=seed).fit(X, y)
+
+
+@pytest.fixture(scope='session')
+def clf():
+    return make_clf()
+
+
+@pytest.fixture
+def model_path(tmp_path, clf):
+    path = tmp_path / 'stand_in.pkl'
+    joblib.dump(clf, path)
+    return str(path)
+
+
+@pytest.fixture
+def row():
+    return np.array(DEFAULT_INPUT, dtype=float).reshape(1, -1)
+
+
+@pytest.fixture(autouse=True)
+def store_in_tmp(tmp_path, monkeypatch):
+    monkeypatch.setenv('MDVO_STORE_PATH', str(tmp_path / 'predictions.sqlite'))
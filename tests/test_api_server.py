@@ -0,0 +1,82 @@
+import asyncio
+import json
+import queue
+from http import HTTPStatus
+
+import pytest
+
+from api_server import PredictionService, RequestError
+from predictor import DEFAULT_INPUT, FEATURES
+
+
+@pytest.fixture
+def service(model_path, clf):
+    service = PredictionService(model_path, clf=clf, store=False)
+    yield service
+    service.batcher.close()
+    service.executor.shutdown()
+
+
+def patient(**changes):
+    return {**dict(zip(FEATURES, DEFAULT_INPUT)), **changes}
+
+
+def post(service, path, payload):
+    try:
+        return asyncio.run(service.handle('POST', path, json.dumps(payload).encode()))
+    except RequestError as e:
+        return e.status, e.payload()
+
+
+def test_predict(service, clf):
+    status, body = post(service, '/predict', patient())
+    assert status == HTTPStatus.OK
+    assert body['probs'] == pytest.approx(clf.predict_proba([DEFAULT_INPUT])[0, 1])
+    assert body['ci_lower'] <= body['probs'] <= body['ci_upper']
+
+
+def test_predict_batch(service):
+    status, body = post(service, '/predict/batch', {'patients': [patient(), patient(nihss=20)]})
+    assert status == HTTPStatus.OK and len(body['predictions']) == 2
+
+
+def test_invalid_values_are_400_with_a_report(service):
+    status, body = post(service, '/predict', patient(age=500, sex_numeric=7, glucose=-1))
+    assert status == HTTPStatus.BAD_REQUEST
+    assert set(body['invalid']) == {'age', 'sex_numeric', 'glucose'}
+    assert body['invalid']['age']['values'] == [500]
+    status, body = post(service, '/predict/batch', {'patients': [patient(), patient(nihss=99)]})
+    assert status == HTTPStatus.BAD_REQUEST
+    assert body['invalid']['nihss']['rows'] == [1]
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/predict', {'age': 72}),                          # missing features
+    ('/predict', patient(sex_numeric="Robot")),         # unknown label
+    ('/predict/batch', {'patients': []}),
+    ('/predict/batch', [1, 2]),
+])
+def test_malformed_requests_are_400(service, path, payload):
+    status, body = post(service, path, payload)
+    assert status == HTTPStatus.BAD_REQUEST and body['error']
+
+
+def raise_full(*args, **kwargs):
+    raise queue.Full
+
+
+def test_full_model_queue_is_429(service, monkeypatch):
+    profiled = service.profiled('full')
+    monkeypatch.setattr(profiled.batcher, 'submit', raise_full)
+    monkeypatch.setattr(profiled, 'predict_batch', raise_full)
+    status, body = post(service, '/predict', patient())
+    assert status == HTTPStatus.TOO_MANY_REQUESTS
+    status, body = post(service, '/predict/batch', {'patients': [patient()]})
+    assert status == HTTPStatus.TOO_MANY_REQUESTS
+    assert service.rejected == 2 and service.pending == 0
+
+
+def test_admission_limit_is_429(service):
+    service.pending = service.max_pending
+    status, _ = post(service, '/predict', patient())
+    assert status == HTTPStatus.TOO_MANY_REQUESTS
@@ -0,0 +1,83 @@
+import queue
+import threading
+
+import numpy as np
+import pytest
+
+from inference_batcher import InferenceBatcher
+
+
+class BlockingModel:
+    """Wraps a model; predict_proba waits until released, so requests pile up."""
+
+    def __init__(self, clf):
+        self.clf = clf
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def predict_proba(self, X):
+        self.entered.set()
+        assert self.release.wait(10)
+        return self.clf.predict_proba(X)
+
+
+@pytest.fixture
+def blocked(clf):
+    model = BlockingModel(clf)
+    batcher = InferenceBatcher(model, max_wait_ms=0, max_pending=2)
+    yield model, batcher
+    model.release.set()
+    batcher.close()
+
+
+def test_batch_matches_direct_scoring(clf):
+    X = np.vstack([np.full(16, 1.0), np.full(16, 5.0)])
+    batcher = InferenceBatcher(clf, max_wait_ms=20)
+    futures = [batcher.submit(x) for x in X]
+    got = [f.result(5) for f in futures]
+    batcher.close()
+    assert [p for p, _, _ in got] == pytest.approx(clf.predict_proba(X)[:, 1])
+
+
+def test_full_queue_raises(blocked, row):
+    model, batcher = blocked
+    running = batcher.submit(row)
+    assert model.entered.wait(5)        # the worker holds the first request
+    queued = [batcher.submit(row), batcher.submit(row)]
+    with pytest.raises(queue.Full):
+        batcher.submit(row)
+    model.release.set()
+    assert all(f.result(5) for f in [running] + queued)
+
+
+def test_score_rows_timeout_cancels_queued_chunks(blocked, row):
+    model, batcher = blocked
+    batcher.submit(row)
+    assert model.entered.wait(5)
+    X = np.repeat(row, 4, axis=0)
+    with pytest.raises(TimeoutError):
+        batcher.score_rows(X, timeout=0.2, chunk_size=2)
+    model.release.set()
+    batcher.close()
+    batcher._worker.join(5)
+    assert batcher.n_cancelled == 2
+
+
+def test_score_rows_full_cancels_submitted_chunks(blocked, row):
+    model, batcher = blocked
+    batcher.submit(row)
+    assert model.entered.wait(5)
+    with pytest.raises(queue.Full):
+        batcher.score_rows(np.repeat(row, 6, axis=0), chunk_size=2)     # third chunk has no room
+    model.release.set()
+    batcher.close()
+    batcher._worker.join(5)
+    assert batcher.n_cancelled == 2
+
+
+def test_closed_batcher_scores_inline(clf, row):
+    batcher = InferenceBatcher(clf)
+    batcher.close()
+    batcher._worker.join(5)
+    probs, _, _ = batcher.submit(row).result(0)
+    assert probs == pytest.approx(clf.predict_proba(row)[0, 1])
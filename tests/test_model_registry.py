@@ -0,0 +1,52 @@
+import json
+
+import joblib
+import pytest
+
+from conftest import make_clf
+from inference_profiles import ProfiledModel
+from model_registry import ModelRegistry, read_model_info
+from startup import ModelLoader
+
+
+@pytest.fixture
+def model_dir(tmp_path, clf):
+    joblib.dump(clf, tmp_path / 'a.pkl')
+    joblib.dump(make_clf(seed=1), tmp_path / 'b.pkl')
+    (tmp_path / 'b.json').write_text(json.dumps({'label': "Model B", 'threshold': 0.3}))
+    return tmp_path
+
+
+def test_sidecar(model_dir):
+    info = read_model_info(str(model_dir / 'b.pkl'))
+    assert (info.name, info.label, info.threshold) == ('b', "Model B", 0.3)
+
+
+def test_profiled_needs_a_loaded_model(tmp_path):
+    loader = ModelLoader(str(tmp_path / 'missing.pkl'))
+    with pytest.raises(RuntimeError):
+        loader.wait(10)
+    with pytest.raises(RuntimeError, match="not loaded"):
+        loader.profiled('fast')
+
+
+def test_profiled_is_built_once(model_path):
+    loader = ModelLoader(model_path).wait(30)
+    fast = loader.profiled('fast')
+    assert isinstance(fast, ProfiledModel) and loader.profiled('fast') is fast
+    assert len(fast.clf.estimators_) == 4 and loader.profiled().clf is loader.clf
+    loader.close()
+
+
+def test_eviction_retires_the_least_recently_used(model_dir):
+    registry = ModelRegistry(str(model_dir), memory_cap_mb=1e-6, default_path=str(model_dir / 'a.pkl'))
+    a = registry.get('a').wait(30)
+    closed = []
+    a.on_close(lambda: closed.append('a'))
+    assert registry.get('a') is a                   # the model in use is never evicted
+    b = registry.get('b')                           # over the cap: 'a' goes once another model is used
+    assert closed == ['a'] and a.batcher._closed
+    b.wait(30)
+    assert list(registry.stats()['loaded']) == ['b']
+    assert registry.get('a') is not a               # loads again on next use
+    b.close()
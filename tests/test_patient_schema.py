@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from patient_schema import (RECORD_DTYPE, encode_columns, format_report, report_fields, to_matrix, to_records,
+                            validate)
+from predictor import DEFAULT_INPUT, FEATURES
+
+
+def columns(n=4):
+    return {f: [v] * n for f, v in zip(FEATURES, DEFAULT_INPUT)}
+
+
+def test_valid_rows_round_trip():
+    X = encode_columns(columns())
+    report = validate(X)
+    assert report.ok and report.valid.all()
+    records = to_records(X)
+    assert records.dtype == RECORD_DTYPE
+    assert np.array_equal(to_matrix(records), X)
+
+
+def test_labels_and_numeric_text_are_encoded():
+    data = columns(2)
+    data['sex_numeric'] = ['Male', ' 1 ']
+    data['age'] = ['72', 72]
+    assert validate(data).ok
+
+
+def test_bad_cells_are_reported_per_column():
+    data = columns()
+    data['age'] = ['72', 'eighty', '', '500']           # unparseable, blank, out of range
+    data['sex_numeric'] = ['Robot', 0, 1, 0]            # unknown label
+    data['nihss'] = [6, 6, 6.5, 6]                      # fraction in an integer field
+    report = validate(data)
+    assert not report.ok
+    assert report.valid.tolist() == [False, False, False, False]
+    assert report.bad_cells['age'] == 3 and report.bad_rows['age'] == [1, 2, 3]
+    assert report.bad_values['age'] == ['eighty', '', '500']
+    assert report.bad_values['sex_numeric'] == ['Robot']
+    assert report.bad_rows['nihss'] == [2]
+    fields = report_fields(report)
+    assert set(fields) == {'age', 'sex_numeric', 'nihss'}
+    assert fields['sex_numeric']['allowed'] == 'codes [0, 1]'
+    assert "row 1: 'eighty'" in format_report(report)
+
+
+def test_matrix_report_shows_encoded_values():
+    X = encode_columns(columns(2))
+    X[1, FEATURES.index('glucose')] = np.nan
+    X[0, FEATURES.index('age')] = 500
+    report = validate(X)
+    assert report.bad_values == {'age': [500.0], 'glucose': [None]}
+
+
+def test_to_records_refuses_bad_cells():
+    X = encode_columns(columns(1))
+    X[0, 0] = 500
+    with pytest.raises(ValueError, match="age"):
+        to_records(X)
+
+
+def test_missing_feature():
+    data = columns()
+    del data['glucose']
+    with pytest.raises(ValueError, match="glucose"):
+        encode_columns(data)
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from prediction_cache import PredictionCache, normalize_features
+from predictor import model_identity
+
+
+def test_key_ignores_float_noise_and_shape(row):
+    cache = PredictionCache(model_id='m')
+    assert cache.key(row) == cache.key(row.ravel().tolist()) == cache.key(row + 1e-9)
+    assert cache.key(row) != cache.key(row + 1e-3)
+    assert normalize_features(row) == tuple(float(x) for x in row.ravel())
+
+
+def test_key_includes_model_identity(row):
+    assert PredictionCache(model_id='a').key(row) != PredictionCache(model_id='b').key(row)
+
+
+def test_identity_changes_when_model_file_is_replaced(model_path):
+    before = model_identity(model_path)
+    assert model_identity(model_path) == before
+    with open(model_path, 'ab') as f:
+        f.write(b'\0')
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert model_identity(model_path) != before
+
+
+def test_lru_eviction_and_counters():
+    cache = PredictionCache(maxsize=2, model_id='m')
+    keys = [cache.key(np.full(16, i)) for i in range(3)]
+    cache.put(keys[0], 'a')
+    cache.put(keys[1], 'b')
+    assert cache.get(keys[0]) == 'a'        # now most recently used
+    cache.put(keys[2], 'c')                 # evicts keys[1]
+    assert keys[1] not in cache and keys[0] in cache
+    assert cache.get(keys[1]) is None
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 1, 1)
+
+
+def test_get_or_compute_computes_once(row):
+    cache = PredictionCache(model_id='m')
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_compute(row, lambda: calls.append(1) or 'p') == 'p'
+    assert len(calls) == 1
@@ -0,0 +1,59 @@
+import numpy as np
+
+from prediction_store import PredictionStore
+from predictor import DECISION_CI, predict_one
+
+
+def ids(store):
+    return {m for (m,) in store._conn().execute('SELECT DISTINCT model FROM predictions')}
+
+
+def fill(path, model_id, X):
+    store = PredictionStore(str(path), model_id)
+    store.put_many(X, np.full(len(X), 0.5), np.full(len(X), 0.4), np.full(len(X), 0.6))
+    return store
+
+
+def test_round_trip(tmp_path, model_path, clf, row):
+    store = PredictionStore.for_model(model_path)
+    assert store.get(row) is None
+    prediction = predict_one(clf, row)
+    store.put(row, prediction)
+    assert store.get(row)[:4] == prediction[:4]
+    assert store.model_id.endswith(f":{DECISION_CI}")
+
+
+def test_purge_is_scoped_to_the_model_file(tmp_path, row):
+    path = tmp_path / 'shared.sqlite'
+    current = f"no_m2_24h.pkl@new:{DECISION_CI}"
+    rows = {
+        f"no_m2_24h.pkl@old:{DECISION_CI}": True,           # older version of the same file
+        f"no_m2_24h.pkl@new:other-ci": True,                # same file, other decision interval
+        f"no_m2_24h.pkl@old:{DECISION_CI}/fast": True,      # older version's reduced profile
+        f"{current}/fast": False,                           # current version's reduced profile
+        f"noXm2_24h.pkl@old:{DECISION_CI}": False,          # '_' is not a wildcard
+        f"no_m2_24h.pkl.bak@old:{DECISION_CI}": False,      # another file sharing the prefix
+        f"other.pkl@old:{DECISION_CI}": False,
+    }
+    for model_id in rows:
+        fill(path, model_id, row)
+    store = fill(path, current, row)
+    assert store.purge_stale() == sum(rows.values())
+    assert ids(store) == {current} | {m for m, stale in rows.items() if not stale}
+    assert store.get(row) is not None
+
+
+def test_reduced_profile_has_its_own_rows(model_path):
+    full = PredictionStore.for_model(model_path, profile='full')
+    fast = PredictionStore.for_model(model_path, profile='fast')
+    assert fast.model_id == f"{full.model_id}/fast"
+
+
+def test_eviction_keeps_the_newest(tmp_path):
+    X = np.arange(20 * 16, dtype=float).reshape(20, 16)
+    store = fill(tmp_path / 'capped.sqlite', 'm', X[:10])
+    store.put_many(X[10:], np.zeros(10), np.zeros(10), np.zeros(10))
+    store.max_rows = 10
+    assert store.evict() == 11
+    assert store.stats()['rows'] == 9
+    assert all(store.get(x) is None for x in X[:10])